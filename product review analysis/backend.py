@@ -1,202 +1,175 @@
-from flask import Flask, render_template, request, jsonify
-import pickle
-import re
-import nltk
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
-import sklearn
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from flask import Flask, Response, g, render_template, request, jsonify
+import logging
+import os
+import threading
 import time
+import numpy as np
+from text_preprocessing import preprocess_batch
+import parallel
+from model_artifact import CompiledModel, load_model_set
+from model_registry import MODEL_DIR, ModelRegistry, category_for_url, model_paths
+from fused_scorer import FusedScorer, FUSED_BATCH_LIMIT
+from micro_batcher import MicroBatcher
+from prediction_cache import prediction_cache
+from review_store import review_store, product_id
+from jobs import JobQueue, QueueFull
+from dedup import make_deduplicator
+import metrics
+from metrics import stage_seconds, http_request_seconds
 
-# Download required NLTK data
-try:
-    stopwords_set = set(stopwords.words('english'))
-except LookupError:
-    nltk.download('stopwords')
-    stopwords_set = set(stopwords.words('english'))
+# pandas (CSV uploads), the scrapers (requests, BeautifulSoup), NLTK and
+# sklearn are imported on first use; see warmup()
 
-emoticon_pattern = re.compile(r'(?::|;|=)(?:-)?(?:\)|\(|D|P)')
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-with open('models/clf.pkl', 'rb') as f:
-    clf = pickle.load(f)
-with open('models/tfidf.pkl', 'rb') as f:
-    tfidf = pickle.load(f)
-
-
-def preprocessing(text):
-    text = re.sub('<[^>]*>', '', text)
-    emojis = emoticon_pattern.findall(text)
-    text = re.sub(r'[\W+]', ' ', text.lower()) + ' '.join(emojis).replace('-', '')
-    prter = PorterStemmer()
-    text = [prter.stem(word) for word in text.split() if word not in stopwords_set]
-    return " ".join(text)
-
-
-def scrape_amazon_reviews(url, max_reviews=50):
-    """Scrape reviews from Amazon product page"""
-    reviews = []
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1'
-    }
-    
-    try:
-        # If it's a product page, try to get the reviews page
-        if '/dp/' in url or '/product/' in url:
-            # Extract ASIN
-            import re
-            asin_match = re.search(r'/dp/([A-Z0-9]{10})', url)
-            if not asin_match:
-                asin_match = re.search(r'/product/([A-Z0-9]{10})', url)
-            
-            if asin_match:
-                asin = asin_match.group(1)
-                # Try to get reviews page
-                domain = 'amazon.com' if 'amazon.com' in url else 'amazon.in'
-                reviews_url = f'https://www.{domain}/product-reviews/{asin}'
-                print(f"Trying reviews URL: {reviews_url}")
-                response = requests.get(reviews_url, headers=headers, timeout=15)
-            else:
-                response = requests.get(url, headers=headers, timeout=15)
-        else:
-            response = requests.get(url, headers=headers, timeout=15)
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        print(f"Response status: {response.status_code}")
-        
-        # Try multiple Amazon review selectors
-        selectors = [
-            ('span', {'data-hook': 'review-body'}),
-            ('div', {'data-hook': 'review-body'}),
-            ('div', {'class': 'review-text-content'}),
-            ('div', {'class': 'a-expander-content reviewText review-text-content'}),
-            ('span', {'class': 'review-text-content'}),
-        ]
-        
-        for tag, attrs in selectors:
-            review_elements = soup.find_all(tag, attrs)
-            if review_elements:
-                print(f"Found {len(review_elements)} reviews with selector: {tag} {attrs}")
-                for element in review_elements[:max_reviews]:
-                    review_text = element.get_text(strip=True)
-                    # Clean up common Amazon text
-                    review_text = review_text.replace('Read more', '').strip()
-                    if review_text and len(review_text) > 15:
-                        reviews.append(review_text)
-                if reviews:
-                    break
-        
-        # Also get review titles
-        title_selectors = [
-            ('a', {'data-hook': 'review-title'}),
-            ('span', {'data-hook': 'review-title'}),
-            ('div', {'data-hook': 'review-title'}),
-        ]
-        
-        for tag, attrs in title_selectors:
-            title_elements = soup.find_all(tag, attrs)
-            if title_elements:
-                print(f"Found {len(title_elements)} titles with selector: {tag} {attrs}")
-                for element in title_elements[:max_reviews]:
-                    title_text = element.get_text(strip=True)
-                    # Remove star ratings from titles
-                    title_text = re.sub(r'^\d+\.\d+\s+out of \d+ stars\s*', '', title_text)
-                    if title_text and len(title_text) > 5 and title_text not in reviews:
-                        reviews.append(title_text)
-                if len(reviews) >= 10:
-                    break
-        
-        print(f"Total reviews scraped: {len(reviews)}")
-                
-    except Exception as e:
-        print(f"Error scraping Amazon: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    return reviews
+# Rows read from an uploaded CSV at a time; bounds peak memory per upload
+CSV_CHUNK_SIZE = int(os.environ.get('CSV_CHUNK_SIZE', 50000))
 
+# Per-category models live in subdirectories (see model_registry.py)
+MODEL_PATHS = model_paths(MODEL_DIR)
 
-def scrape_generic_reviews(url, max_reviews=50):
-    """Generic scraper for other websites"""
-    reviews = []
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5'
-    }
-    
+# 1: import without loading models or heavy libraries; they load on the
+# first request, or up front when the server calls warmup()
+LAZY_STARTUP = os.environ.get('LAZY_STARTUP', '0') == '1'
+# Comma-separated categories whose models warmup() loads besides the
+# default, so a prefork server shares them between workers
+MODEL_PRELOAD = [name.strip() for name in os.environ.get('MODEL_PRELOAD', '').split(',') if name.strip()]
+
+# Seconds between checks of the model files for a new version
+MODEL_CHECK_INTERVAL = float(os.environ.get('MODEL_CHECK_INTERVAL', 5))
+
+# Products compared or ranked need at least this many reviews
+MIN_PRODUCT_REVIEWS = 3
+# Most URLs plus CSVs accepted by one ranking request
+RANK_MAX_PRODUCTS = int(os.environ.get('RANK_MAX_PRODUCTS', 50))
+# Seconds a ranking request may spend scraping; it fetches many more pages
+# than a comparison, so it gets its own deadline
+RANK_SCRAPE_DEADLINE = float(os.environ.get('RANK_SCRAPE_DEADLINE', 90))
+
+
+def load_serving_models(paths=MODEL_PATHS):
+    """Load one model set and build its fused scorer; returns a dict describing them"""
+    # Memory-maps model.bin when present (shared across workers),
+    # otherwise unpickles clf.pkl and tfidf.pkl; the version is that of
+    # the files loaded, even if an upgrade lands meanwhile
+    clf, tfidf, version = load_model_set(paths)
+
+    # Direct n-gram/IDF/coefficient scorer for small batches
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        print(f"Generic scraper - Response status: {response.status_code}")
-        
-        # Look for common review patterns
-        possible_selectors = [
-            {'class': re.compile(r'review', re.I)},
-            {'class': re.compile(r'comment', re.I)},
-            {'class': re.compile(r'feedback', re.I)},
-            {'itemprop': 'reviewBody'},
-            {'itemprop': 'description'},
-            {'data-hook': re.compile(r'review', re.I)},
-        ]
-        
-        for selector in possible_selectors:
-            elements = soup.find_all(['p', 'div', 'span'], selector)
-            print(f"Found {len(elements)} elements with selector: {selector}")
-            for element in elements[:max_reviews]:
-                text = element.get_text(strip=True)
-                if text and 20 < len(text) < 500 and text not in reviews:
-                    reviews.append(text)
-            
-            if len(reviews) >= 10:
-                break
-        
-        print(f"Generic scraper found {len(reviews)} reviews")
-                
+        scorer = FusedScorer.from_models(clf, tfidf)
     except Exception as e:
-        print(f"Error scraping: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    return reviews[:max_reviews]
+        # Small batches then go through the sklearn transform path
+        logger.warning("Fused scorer disabled: %s", e)
+        scorer = None
 
+    # What the registry's memory bound counts: the files actually loaded
+    loaded = paths[2:] if isinstance(clf, CompiledModel) else paths[:2]
+    size = sum(os.path.getsize(path) for path in loaded)
+    return {'clf': clf, 'tfidf': tfidf, 'scorer': scorer, 'version': version, 'paths': paths, 'bytes': size}
 
-def scrape_reviews_from_url(url, max_reviews=50):
-    """Main function to scrape reviews based on URL"""
-    domain = urlparse(url).netloc.lower()
-    
-    if 'amazon' in domain:
-        return scrape_amazon_reviews(url, max_reviews)
-    else:
-        return scrape_generic_reviews(url, max_reviews)
 
+def _models_swapped(category, current):
+    # Entries of the old version can no longer be hit
+    if prediction_cache is not None:
+        prediction_cache.clear()
 
-def analyze_reviews(reviews):
-    """Analyze a list of reviews and return sentiment stats"""
-    if not reviews:
-        return None
-    
-    # Preprocess reviews
-    processed_reviews = [preprocessing(r) for r in reviews]
-    
-    # Vectorize
-    vectors = tfidf.transform(processed_reviews)
-    
-    # Predict
-    predictions = clf.predict(vectors)
-    
+
+# A new model set replaces the old one as a whole, so a request always
+# sees a consistent set
+registry = ModelRegistry(MODEL_DIR, load_serving_models, MODEL_CHECK_INTERVAL, on_swap=_models_swapped)
+
+
+def models_for(category=None):
+    """Return the models serving a category (None or unknown: the default models)"""
+    return registry.get(category)
+
+
+def current_models():
+    """Return the default models, loading them on first use"""
+    return registry.get(None)
+
+# Opt-in process pool for large batches (PARALLEL_WORKERS > 0)
+parallel.init_pool()
+
+
+def _score_reviews(current, reviews):
+    """Preprocess, vectorize and score raw reviews with one set of models"""
+    scorer = current['scorer']
+    if scorer is not None and len(reviews) <= FUSED_BATCH_LIMIT:
+        with stage_seconds.time(stage='preprocess'):
+            processed_reviews = preprocess_batch(reviews)
+        # Vectorization and prediction happen in one pass here
+        with stage_seconds.time(stage='fused_score'):
+            return [scorer.score(review) for review in processed_reviews]
+    labels, probabilities = parallel.score_parallel(reviews, current['clf'], current['tfidf'],
+                                                    current['paths'], current['version'])
+    return list(zip(labels, probabilities.tolist()))
+
+
+def predict_reviews_with_proba(reviews, category=None):
+    """
+    Return (label, positive probability) pairs for a list of raw reviews
+
+    Repeated reviews are answered from the prediction cache before any
+    preprocessing; each distinct uncached review is scored once.
+    """
+    return predict_with_models(models_for(category), reviews)
+
+
+def predict_with_models(current, reviews):
+    """predict_reviews_with_proba() with a given set of models, e.g. one whose version is being stored"""
+    if prediction_cache is None:
+        return _score_reviews(current, reviews)
+
+    keys = [prediction_cache.key(review, current['version']) for review in reviews]
+    results = prediction_cache.get_many(keys)
+
+    missing = {}
+    for i, (key, result) in enumerate(zip(keys, results)):
+        if result is None and key not in missing:
+            missing[key] = i
+    if missing:
+        scored = dict(zip(missing, _score_reviews(current, [reviews[i] for i in missing.values()])))
+        prediction_cache.put_many(scored.items())
+        results = [scored[key] if result is None else result for key, result in zip(keys, results)]
+    return results
+
+
+def predict_reviews(reviews, category=None):
+    """Preprocess, vectorize and predict a list of raw reviews"""
+    return np.array([label for label, _ in predict_reviews_with_proba(reviews, category)])
+
+
+# Combine concurrent /api/predict calls into one model call, one batcher
+# per model set so that a batch never mixes categories
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def batcher_for(category=None):
+    """Return the micro-batcher for the models serving a category"""
+    category = registry.resolve(category)
+    with _batchers_lock:
+        if category not in _batchers:
+            _batchers[category] = MicroBatcher(lambda reviews: predict_reviews_with_proba(reviews, category))
+        return _batchers[category]
+
+
+def summarize_predictions(predictions):
+    """Return sentiment stats for a sequence of 0/1 predictions"""
+    predictions = list(predictions)
+    return summarize_counts(predictions.count(1), predictions.count(0))
+
+
+def summarize_counts(positive_count, negative_count):
+    """Return sentiment stats for positive/negative counts"""
     # Calculate stats
-    positive_count = int(list(predictions).count(1))
-    negative_count = int(list(predictions).count(0))
+    positive_count = int(positive_count)
+    negative_count = int(negative_count)
     total = positive_count + negative_count
     
     if total == 0:
@@ -220,30 +193,162 @@ def analyze_reviews(reviews):
         'negative_percentage': round(100 - positive_percentage, 1)
     }
 
-@app.route('/', methods=['GET', 'POST'])
-def analyze_sentiment():
-    if request.method == 'POST':
-        uploaded_file = request.files.get('file')
 
-        if uploaded_file:
-            # Read CSV
-            df = pd.read_csv(uploaded_file)
+def analyze_reviews(reviews, product=None, category=None):
+    """
+    Analyze a list of reviews and return sentiment stats
+
+    With a product ID the predictions go through the review store, so only
+    reviews that are new for the product or were scored by an older model
+    are scored. category picks a specialized model when one exists.
+    """
+    if not reviews:
+        return None
+
+    return analyze_many([reviews], [product], [category])[0]
+
+
+def analyze_many(review_lists, products=None, categories=None):
+    """
+    analyze_reviews() for several products with one model call per model set
+
+    All reviews that need scoring with the same models are scored together
+    and the predictions are split back per product. products and
+    categories, if given, hold a product ID and a category (or None) per
+    list. Returns one stats dict (or None if empty) per list.
+    """
+    products = products or [None] * len(review_lists)
+    groups = {}
+    for i, category in enumerate(categories or [None] * len(review_lists)):
+        groups.setdefault(registry.resolve(category), []).append(i)
+
+    results = [None] * len(review_lists)
+    for category, indexes in groups.items():
+        current = models_for(category)
+        for i, predictions in zip(indexes, _predict_products(current, [review_lists[i] for i in indexes],
+                                                             [products[i] for i in indexes])):
+            if predictions:
+                results[i] = summarize_predictions(int(label) for label, _ in predictions)
+    return results
 
-            # Expect column name "review_title"
-            reviews = df['review_title'].astype(str).tolist()
 
-            # Preprocess all reviews
-            processed_reviews = [preprocessing(r) for r in reviews]
+def _predict_products(current, review_lists, products):
+    """(label, probability) lists per product with one set of models, through the review store if possible"""
+    if review_store is not None and any(products):
+        return review_store.predictions(zip(products, review_lists), current['version'],
+                                        lambda reviews: predict_with_models(current, reviews))
 
-            # Vectorize all reviews
-            vectors = tfidf.transform(processed_reviews)
+    combined = [review for reviews in review_lists for review in reviews]
+    predictions = predict_with_models(current, combined) if combined else []
+    offsets = np.cumsum([0] + [len(reviews) for reviews in review_lists]).tolist()
+    return [predictions[start:end] for start, end in zip(offsets, offsets[1:])]
 
-            # Predict sentiments
-            predictions = clf.predict(vectors)
 
-            # Count positive/negative
-            positive_count = list(predictions).count(1)
-            negative_count = list(predictions).count(0)
+def rank_products(products, min_reviews=MIN_PRODUCT_REVIEWS, timed_out=()):
+    """
+    Rank (name, reviews, product ID, category) tuples by their share of positive reviews
+
+    Returns one row per product, best first: the analyze_reviews() stats
+    plus 'rank', 'product' and 'timed_out'. Products with fewer than
+    min_reviews reviews are listed last, unranked, with an 'error'. The
+    product ID may be None for sources that aren't kept in the review store,
+    and the category None for the default model. timed_out names the
+    products whose scrape hit the deadline before every page was fetched.
+    """
+    usable = [product for product in products if len(product[1]) >= min_reviews]
+    results = analyze_many([reviews for _, reviews, _, _ in usable], [product for _, _, product, _ in usable],
+                           [category for _, _, _, category in usable])
+    ranked = sorted(({'product': name, **result} for (name, _, _, _), result in zip(usable, results)),
+                    key=lambda row: (-row['positive_percentage'], -row['total']))
+    for rank, row in enumerate(ranked, start=1):
+        row['rank'] = rank
+        row['timed_out'] = row['product'] in timed_out
+
+    unranked = [{'product': name, 'rank': None, 'total': len(reviews), 'timed_out': name in timed_out,
+                 'error': (f'Scraping timed out ({len(reviews)} reviews found)' if name in timed_out
+                           else f'Only {len(reviews)} reviews found')}
+                for name, reviews, _, _ in products if len(reviews) < min_reviews]
+    return ranked + unranked
+
+
+def read_review_csv(csv_file):
+    """Review texts from an uploaded CSV's review_title column, duplicates removed"""
+    import pandas as pd
+
+    reviews = pd.read_csv(csv_file, usecols=['review_title'])['review_title'].astype(str).tolist()
+    return make_deduplicator('csv').filter(reviews)
+
+
+def count_csv_sentiments(csv_file, chunk_size=CSV_CHUNK_SIZE, on_chunk=None):
+    """
+    Stream a review CSV in chunks and return (positive, negative) counts
+
+    Exact and near-duplicate reviews anywhere in the file are counted once.
+    on_chunk(rows_processed, positive, negative), if given, is called after
+    each chunk; background jobs use it to report progress and to stop.
+    """
+    import pandas as pd
+
+    positive_count = 0
+    negative_count = 0
+    rows_processed = 0
+    dedup = make_deduplicator('csv')
+
+    # Only the review column is parsed, one chunk at a time
+    for chunk in pd.read_csv(csv_file, usecols=['review_title'], chunksize=chunk_size):
+        reviews = chunk['review_title'].astype(str).tolist()
+        rows_processed += len(reviews)
+        reviews = dedup.filter(reviews)
+        if reviews:
+            predictions = predict_reviews(reviews)
+            positive_count += int((predictions == 1).sum())
+            negative_count += int((predictions == 0).sum())
+        if on_chunk is not None:
+            on_chunk(rows_processed, positive_count, negative_count)
+
+    if dedup.removed:
+        logger.info("Skipped %d duplicate reviews out of %d rows", dedup.removed, rows_processed)
+    return positive_count, negative_count
+
+
+# Large uploads posted to /api/jobs are analysed in background processes
+job_queue = JobQueue(count_csv_sentiments)
+
+
+def render_page(template, **context):
+    """render_template, timed as the 'render' stage"""
+    with stage_seconds.time(stage='render'):
+        return render_template(template, **context)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                     method=request.method, status=response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of this process's metrics"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/', methods=['GET', 'POST'])
+def analyze_sentiment():
+    if request.method == 'POST':
+        uploaded_file = request.files.get('file')
+
+        if uploaded_file:
+            # Expect column name "review_title"; read in fixed-size chunks
+            positive_count, negative_count = count_csv_sentiments(uploaded_file)
 
             # Majority sentiment
             if positive_count > negative_count:
@@ -253,12 +358,95 @@ def analyze_sentiment():
             else:
                 final_sentiment = "Both sentiments are equal."
 
-            return render_template('frontend.html',
-                                   sentiment=final_sentiment,
-                                   positive=positive_count,
-                                   negative=negative_count)
+            return render_page('frontend.html',
+                               sentiment=final_sentiment,
+                               positive=positive_count,
+                               negative=negative_count)
+
+    return render_page('frontend.html')
+
 
-    return render_template('frontend.html')
+@app.route('/api/predict', methods=['POST'])
+def predict_api():
+    """JSON API: {"review": "..."} or {"reviews": ["...", ...]}, plus an optional category name"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object with "review" or "reviews"'}), 400
+
+    if 'reviews' in payload:
+        reviews = payload['reviews']
+    elif 'review' in payload:
+        reviews = [payload['review']]
+    else:
+        return jsonify({'error': 'Expected a JSON object with "review" or "reviews"'}), 400
+
+    if not isinstance(reviews, list) or not all(isinstance(r, str) for r in reviews):
+        return jsonify({'error': 'Reviews must be strings'}), 400
+    if not reviews:
+        return jsonify({'error': 'No reviews provided'}), 400
+    category = payload.get('category')
+    if category is not None and not isinstance(category, str):
+        return jsonify({'error': 'Category must be a string'}), 400
+
+    # Small requests share a model call with concurrent ones; big ones go straight through
+    batcher = batcher_for(category)
+    if len(reviews) <= batcher.max_batch_size:
+        results = batcher.predict(reviews)
+    else:
+        results = predict_reviews_with_proba(reviews, category)
+
+    predictions = [{
+        'review': review,
+        'label': int(label),
+        'sentiment': 'POSITIVE' if label == 1 else 'NEGATIVE',
+        'positive_probability': round(float(probability), 4)
+    } for review, (label, probability) in zip(reviews, results)]
+
+    return jsonify({
+        'predictions': predictions,
+        'summary': summarize_predictions([int(label) for label, _ in results])
+    })
+
+
+def job_response(job):
+    """Public JSON view of a job record"""
+    body = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'progress': round(job['progress'], 4),
+        'rows_processed': job['rows_processed'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+    if job['status'] == 'done':
+        body['result'] = summarize_counts(job['positive'], job['negative'])
+    if job['error']:
+        body['error'] = job['error']
+    return body
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue an uploaded CSV for background analysis and return its job ID"""
+    uploaded_file = request.files.get('file')
+    if not uploaded_file:
+        return jsonify({'error': 'Expected a CSV upload in the "file" field'}), 400
+    try:
+        job_id = job_queue.submit(uploaded_file)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """GET polls a job's progress and result; DELETE cancels it"""
+    job = job_queue.cancel(job_id) if request.method == 'DELETE' else job_queue.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job_response(job))
 
 
 @app.route('/compare', methods=['GET', 'POST'])
@@ -268,26 +456,26 @@ def compare_products():
         url2 = request.form.get('url2', '').strip()
         
         if not url1 or not url2:
-            return render_template('compare.html', error="Please provide both URLs")
-        
-        # Scrape reviews from both URLs
-        print(f"Scraping reviews from URL 1: {url1}")
-        reviews1 = scrape_reviews_from_url(url1)
+            return render_page('compare.html', error="Please provide both URLs")
         
-        print(f"Scraping reviews from URL 2: {url2}")
-        reviews2 = scrape_reviews_from_url(url2)
+        from scraper import scrape_reviews_from_urls
+
+        # Scrape reviews from both URLs concurrently
+        logger.info("Scraping reviews from URL 1: %s", url1)
+        logger.info("Scraping reviews from URL 2: %s", url2)
+        reviews1, reviews2 = scrape_reviews_from_urls([url1, url2])
         
-        if not reviews1 or len(reviews1) < 3:
-            return render_template('compare.html', 
-                                 error="Could not find enough reviews from Product 1. Try a different URL or use CSV upload.")
+        if not reviews1 or len(reviews1) < MIN_PRODUCT_REVIEWS:
+            return render_page('compare.html', 
+                             error="Could not find enough reviews from Product 1. Try a different URL or use CSV upload.")
         
-        if not reviews2 or len(reviews2) < 3:
-            return render_template('compare.html', 
-                                 error="Could not find enough reviews from Product 2. Try a different URL or use CSV upload.")
+        if not reviews2 or len(reviews2) < MIN_PRODUCT_REVIEWS:
+            return render_page('compare.html', 
+                             error="Could not find enough reviews from Product 2. Try a different URL or use CSV upload.")
         
-        # Analyze both products
-        result1 = analyze_reviews(reviews1)
-        result2 = analyze_reviews(reviews2)
+        # Analyze both products in one model call
+        result1, result2 = analyze_many([reviews1, reviews2], [product_id(url1), product_id(url2)],
+                                        [category_for_url(url1), category_for_url(url2)])
         
         # Determine winner
         if result1['positive_percentage'] > result2['positive_percentage']:
@@ -300,15 +488,109 @@ def compare_products():
             winner = "tie"
             winner_text = "Both products have similar reviews!"
         
-        return render_template('compare.html',
-                             url1=url1,
-                             url2=url2,
-                             result1=result1,
-                             result2=result2,
-                             winner=winner,
-                             winner_text=winner_text)
+        return render_page('compare.html',
+                         url1=url1,
+                         url2=url2,
+                         result1=result1,
+                         result2=result2,
+                         winner=winner,
+                         winner_text=winner_text)
     
-    return render_template('compare.html')
+    return render_page('compare.html')
+
+
+def collect_products(urls, csv_files):
+    """
+    Scrape every URL concurrently and read every CSV
+
+    Returns the rank_products() tuples and the set of URLs whose scrape
+    timed out.
+    """
+    from scraper import scrape_products
+
+    scraped = scrape_products(urls, timeout=RANK_SCRAPE_DEADLINE) if urls else []
+    products = [(url, reviews, product_id(url), category_for_url(url))
+                for url, (reviews, _) in zip(urls, scraped)]
+    timed_out = {url for url, (_, url_timed_out) in zip(urls, scraped) if url_timed_out}
+    for csv_file in csv_files:
+        try:
+            # Uploaded files have no stable product identity, so they aren't stored
+            products.append((csv_file.filename, read_review_csv(csv_file), None, None))
+        except ValueError:
+            raise ValueError(f'{csv_file.filename} has no "review_title" column')
+    return products, timed_out
+
+
+@app.route('/rank', methods=['GET', 'POST'])
+def rank_page():
+    """Rank up to RANK_MAX_PRODUCTS product URLs and/or CSV uploads"""
+    if request.method == 'POST':
+        urls_text = request.form.get('urls', '')
+        urls = [line.strip() for line in urls_text.splitlines() if line.strip()]
+        csv_files = [f for f in request.files.getlist('files') if f and f.filename]
+
+        if not urls and not csv_files:
+            return render_page('rank.html', error="Please provide product URLs or CSV files", urls=urls_text)
+        if len(urls) + len(csv_files) > RANK_MAX_PRODUCTS:
+            return render_page('rank.html', error=f"Please rank at most {RANK_MAX_PRODUCTS} products at a time",
+                               urls=urls_text)
+
+        logger.info("Ranking %d URLs and %d CSV files", len(urls), len(csv_files))
+        try:
+            products, timed_out = collect_products(urls, csv_files)
+            ranking = rank_products(products, timed_out=timed_out)
+        except ValueError as e:
+            return render_page('rank.html', error=str(e), urls=urls_text)
+        return render_page('rank.html', urls=urls_text, ranking=ranking)
+
+    return render_page('rank.html')
+
+
+@app.route('/api/rank', methods=['POST'])
+def rank_api():
+    """JSON API: {"urls": ["...", ...]} -> ranked per-product stats"""
+    payload = request.get_json(silent=True)
+    urls = payload.get('urls') if isinstance(payload, dict) else None
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url.strip() for url in urls):
+        return jsonify({'error': 'Expected a JSON object with a non-empty "urls" list'}), 400
+    if len(urls) > RANK_MAX_PRODUCTS:
+        return jsonify({'error': f'At most {RANK_MAX_PRODUCTS} URLs can be ranked at a time'}), 400
+
+    products, timed_out = collect_products([url.strip() for url in urls], [])
+    return jsonify({'ranking': rank_products(products, timed_out=timed_out)})
+
+
+WARMUP_REVIEWS = ["Great product, works perfectly! :)", "Stopped working after a week, waste of money"]
+
+
+def warmup():
+    """
+    Load everything the first request would otherwise wait for
+
+    Loads the default models and those of the MODEL_PRELOAD categories,
+    imports pandas and the scrapers, and scores sample reviews through both
+    the fused and the sklearn path (filling regex and stemmer state).
+    Called at import unless LAZY_STARTUP=1; servers using lazy startup
+    should call it once per worker before taking traffic, e.g. from
+    gunicorn's post_worker_init hook.
+    """
+    started = time.perf_counter()
+    current = current_models()
+    for category in MODEL_PRELOAD:
+        if registry.resolve(category) is None:
+            logger.warning("MODEL_PRELOAD: no models for category %r", category)
+        models_for(category)
+    # Imported for their import cost only
+    import pandas
+    import scraper
+    _score_reviews(current, WARMUP_REVIEWS)
+    parallel.score_parallel(WARMUP_REVIEWS, current['clf'], current['tfidf'], current['paths'],
+                            current['version'], threshold=float('inf'))
+    logger.info("Warmed up in %.2fs (model version %s)", time.perf_counter() - started, current['version'])
+
+
+if not LAZY_STARTUP:
+    warmup()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,445 @@
+"""
+Offline benchmark suite
+Times preprocessing, tfidf.transform, clf.predict and analyze_reviews() at
+several batch sizes, the Amazon/generic scrapers against saved HTML
+fixtures served by a local stub server, a bulk crawl of the stub server
+(with throttled pages retried), end-to-end Flask test-client
+requests (CSV uploads of 1k, 100k and 1M rows, and /compare), and importing
+the backend in a fresh interpreter with and without LAZY_STARTUP. No
+network access is needed.
+
+Before timing anything, the fused scorer and the compiled artifact are
+checked against tfidf.transform + clf.decision_function from the pickled
+models on a fixed review sample.
+
+Results are written as JSON and checked against benchmarks/thresholds.json
+(minimum throughput and maximum p99 latency per benchmark); the script
+exits with status 1 if any benchmark regresses or a scorer disagrees with
+sklearn, so it can gate a deploy.
+
+Usage:
+    python benchmarks/run_benchmarks.py              # full run
+    python benchmarks/run_benchmarks.py --quick      # small batches, 1k-row CSV only
+    python benchmarks/run_benchmarks.py --calibrate  # rewrite thresholds from this run
+"""
+
+import argparse
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+THRESHOLDS_PATH = os.path.join(BENCH_DIR, 'thresholds.json')
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results.json')
+
+# Benchmark the uncached code paths unless told otherwise
+os.environ.setdefault('SCRAPE_CACHE_ENABLED', '0')
+os.environ.setdefault('PREDICTION_CACHE_ENABLED', '0')
+os.environ.setdefault('REVIEW_STORE_ENABLED', '0')
+# Keep per-page scraper logging out of the report
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+sys.path.insert(0, PROJECT_DIR)
+
+import numpy as np
+import sklearn
+import backend
+from fused_scorer import FusedScorer, check_equivalence
+from model_artifact import CompiledModel
+from text_preprocessing import preprocess_batch
+from crawler import CrawlScheduler
+from scraper import (extract_amazon_reviews, extract_generic_reviews,
+                     scrape_amazon_reviews, scrape_generic_reviews)
+
+BATCH_SIZES = (1, 32, 256, 4096)
+QUICK_BATCH_SIZES = (1, 32, 256)
+CSV_ROWS = (1000, 100000, 1000000)
+QUICK_CSV_ROWS = (1000,)
+# Product URLs per crawl; every fifth is throttled once
+CRAWL_PRODUCTS = 200
+# Synthetic reviews, plus the fixture pages' reviews, in the equivalence sample
+EQUIVALENCE_REVIEWS = 2000
+
+# Each benchmark runs for at least this many calls and seconds (a single
+# call is enough once it alone takes longer than MIN_SECONDS)
+MIN_CALLS = 5
+MIN_SECONDS = 1.0
+MAX_CALLS = 2000
+
+# --calibrate sets thresholds this far below the measured throughput and
+# above the measured p99, to leave room for run-to-run noise; sub-millisecond
+# stages also get a fixed p99 allowance since one scheduler hiccup exceeds 3x
+CALIBRATION_MARGIN = 0.5
+P99_SLACK_MS = 1.0
+
+POSITIVE_PHRASES = ['great product', 'works perfectly', 'love it', 'excellent quality',
+                    'highly recommend', 'fast delivery', 'worth every penny', 'very comfortable',
+                    'battery lasts long', 'exactly as described']
+NEGATIVE_PHRASES = ['stopped working', 'waste of money', 'poor quality', 'very disappointed',
+                    'broke after a week', 'do not buy', 'arrived damaged', 'terrible support',
+                    'cheap plastic', 'not as described']
+FILLER = ['the', 'this', 'i', 'it', 'and', 'after', 'for', 'my', 'was', 'really', 'so',
+          'sound', 'size', 'price', 'color', 'box', 'charger', 'screen', 'daughter', 'use']
+ENDINGS = ['', '!', '.', ' :)', ' :(', '!!', ' :-D']
+
+# Must not be imported by `import backend` under LAZY_STARTUP=1
+HEAVY_MODULES = ('pandas', 'sklearn', 'scipy', 'nltk', 'bs4', 'requests')
+
+
+def make_reviews(n, seed=42):
+    """Deterministic synthetic reviews with a realistic length spread"""
+    rng = random.Random(seed)
+    reviews = []
+    for _ in range(n):
+        phrases = POSITIVE_PHRASES if rng.random() < 0.6 else NEGATIVE_PHRASES
+        words = []
+        for _ in range(rng.randint(1, 4)):
+            words.extend(rng.sample(FILLER, rng.randint(1, 5)))
+            words.append(rng.choice(phrases))
+        text = ' '.join(words)
+        reviews.append(text[0].upper() + text[1:] + rng.choice(ENDINGS))
+    return reviews
+
+
+def measure(fn, items_per_call, min_calls=MIN_CALLS, min_seconds=MIN_SECONDS):
+    """Call fn repeatedly and return latency percentiles and throughput"""
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < MAX_CALLS:
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds and (len(latencies) >= min_calls or latencies[-1] >= min_seconds):
+            break
+
+    samples = np.array(latencies) * 1000
+    return {
+        'items_per_call': items_per_call,
+        'calls': len(latencies),
+        'mean_ms': round(float(samples.mean()), 4),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+        'throughput': round(items_per_call * len(latencies) / sum(latencies), 2),
+    }
+
+
+def run(results, name, fn, items_per_call, **kwargs):
+    """Measure fn and keep it so a regressed benchmark can be re-measured"""
+    _benchmarks[name] = (fn, items_per_call, kwargs)
+    results[name] = measure(fn, items_per_call, **kwargs)
+
+
+_benchmarks = {}
+
+
+def rotating_batches(corpus, batch_size):
+    """Return a function yielding successive batches from corpus, so calls don't repeat one batch"""
+    position = [0]
+
+    def next_batch():
+        start = position[0]
+        if start + batch_size > len(corpus):
+            start = 0
+        position[0] = start + batch_size
+        return corpus[start:start + batch_size]
+    return next_batch
+
+
+def bench_model_stages(results, batch_sizes):
+    corpus = make_reviews(max(batch_sizes) * 8)
+    processed_corpus = preprocess_batch(corpus)
+    current = backend.current_models()
+    tfidf, clf = current['tfidf'], current['clf']
+
+    for size in batch_sizes:
+        print(f"⏱️  Model stages, batch size {size}")
+        raw = rotating_batches(corpus, size)
+        processed = rotating_batches(processed_corpus, size)
+        vectors = tfidf.transform(processed())
+
+        run(results, f'preprocess[batch={size}]', lambda raw=raw: preprocess_batch(raw()), size)
+        run(results, f'tfidf.transform[batch={size}]', lambda processed=processed: tfidf.transform(processed()), size)
+        run(results, f'clf.predict[batch={size}]', lambda vectors=vectors: clf.predict(vectors), size)
+        run(results, f'analyze_reviews[batch={size}]', lambda raw=raw: backend.analyze_reviews(raw()), size)
+
+
+def check_scorers(paths):
+    """
+    Compare the app's scorers with sklearn on a fixed review sample; returns the failures
+
+    The reference is tfidf.transform + clf.decision_function from the
+    pickles in paths. Checked are a fused scorer built from the pickles and,
+    when the app serves model.bin, the compiled model and its fused scorer.
+    """
+    clf_path, tfidf_path, _ = paths
+    if not (os.path.exists(clf_path) and os.path.exists(tfidf_path)):
+        print("⚠️  No pickled models to check the scorers against")
+        return []
+    with open(clf_path, 'rb') as f:
+        clf = pickle.load(f)
+    with open(tfidf_path, 'rb') as f:
+        tfidf = pickle.load(f)
+
+    reviews = make_reviews(EQUIVALENCE_REVIEWS, seed=7)
+    for name in ('amazon_reviews', 'generic_reviews'):
+        with open(os.path.join(FIXTURES_DIR, f'{name}.html'), 'rb') as f:
+            html = f.read()
+        reviews.extend(extract_amazon_reviews(html) if name == 'amazon_reviews' else extract_generic_reviews(html))
+    docs = preprocess_batch(reviews)
+
+    scorers = []
+    try:
+        scorers.append(('fused[pickles]', FusedScorer.from_models(clf, tfidf)))
+    except ValueError as e:
+        print(f"⚠️  No fused scorer for the pickled models: {e}")
+    current = backend.current_models()
+    if isinstance(current['clf'], CompiledModel):
+        scorers.append(('compiled', current['clf']))
+        if current['scorer'] is not None:
+            scorers.append(('fused[compiled]', current['scorer']))
+
+    failures = []
+    for name, scorer in scorers:
+        print(f"🔍 Equivalence of {name} with sklearn on {len(docs)} reviews")
+        try:
+            _, max_difference = check_equivalence(scorer, clf, tfidf, docs)
+        except ValueError as e:
+            failures.append({'benchmark': f'equivalence[{name}]', 'message': str(e)})
+            continue
+        print(f"✅ {name} matches (max decision difference {max_difference:.2g})")
+    return failures
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves fixtures/<name>.html for /<name>
+
+    With ?fail=N in the query, the first N requests for that exact path
+    get 503 with Retry-After: 0, as from a throttling site.
+    """
+
+    failures = {}
+    failures_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = dict(parse_qsl(urlsplit(self.path).query))
+        with self.failures_lock:
+            seen = self.failures[self.path] = self.failures.get(self.path, 0) + 1
+        if seen <= int(query.get('fail', 0)):
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        name = self.path.strip('/').split('?')[0].split('/')[0]
+        path = os.path.join(FIXTURES_DIR, f'{name}.html')
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub_server():
+    """Serve the HTML fixtures on an ephemeral localhost port"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def bench_scrapers(results, base_url):
+    print("⏱️  Scraper parsers")
+    with open(os.path.join(FIXTURES_DIR, 'amazon_reviews.html'), 'rb') as f:
+        amazon_html = f.read()
+    with open(os.path.join(FIXTURES_DIR, 'generic_reviews.html'), 'rb') as f:
+        generic_html = f.read()
+
+    if not scrape_amazon_reviews(f'{base_url}/amazon_reviews') or not scrape_generic_reviews(f'{base_url}/generic_reviews'):
+        raise RuntimeError("Scrapers found no reviews in the fixtures")
+
+    run(results, 'extract_amazon_reviews[page]', lambda: extract_amazon_reviews(amazon_html), 1)
+    run(results, 'extract_generic_reviews[page]', lambda: extract_generic_reviews(generic_html), 1)
+    run(results, 'scrape_amazon_reviews[stub]', lambda: scrape_amazon_reviews(f'{base_url}/amazon_reviews'), 1)
+    run(results, 'scrape_generic_reviews[stub]', lambda: scrape_generic_reviews(f'{base_url}/generic_reviews'), 1)
+
+
+def bench_crawl(results, base_url):
+    print(f"⏱️  Crawling {CRAWL_PRODUCTS} products from the stub server")
+    # One host here, so its limits are raised to what a crawl spreads over many hosts
+    scheduler = CrawlScheduler(workers=16, host_concurrency=16, host_rate=0, backoff=0.01)
+    runs = [0]
+
+    def crawl():
+        runs[0] += 1
+        urls = [f'{base_url}/{"generic" if i % 2 else "amazon"}_reviews?run={runs[0]}&product={i}'
+                + ('&fail=1' if i % 5 == 0 else '') for i in range(CRAWL_PRODUCTS)]
+        crawled = list(scheduler.crawl(urls))
+        if len(crawled) != len(urls) or any(error or not reviews for _, reviews, error in crawled):
+            raise RuntimeError("Crawl missed products from the stub server")
+    run(results, 'crawl[stub]', crawl, CRAWL_PRODUCTS)
+
+
+def bench_routes(results, base_url, csv_rows):
+    client = backend.app.test_client()
+
+    for rows in csv_rows:
+        print(f"⏱️  POST / with a {rows}-row CSV")
+        csv_data = ('review_title\n' + '\n'.join(f'"{r}"' for r in make_reviews(rows, seed=rows))).encode('utf-8')
+
+        def upload(csv_data=csv_data):
+            response = client.post('/', data={'file': (io.BytesIO(csv_data), 'reviews.csv')},
+                                   content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"CSV upload returned {response.status_code}")
+        run(results, f'POST /[csv_rows={rows}]', upload, rows, min_calls=1 if rows >= 100000 else MIN_CALLS)
+
+    print("⏱️  POST /compare against the stub server")
+    form = {'url1': f'{base_url}/generic_reviews', 'url2': f'{base_url}/amazon_reviews?page=1'}
+
+    def compare():
+        response = client.post('/compare', data=form)
+        if response.status_code != 200 or (b'has better reviews' not in response.data
+                                           and b'similar reviews' not in response.data):
+            raise RuntimeError("Comparison did not produce a result")
+    run(results, 'POST /compare[stub]', compare, 1)
+
+
+def import_backend(lazy):
+    """Import the backend in a fresh interpreter; returns the heavy modules it loaded"""
+    env = dict(os.environ, LAZY_STARTUP='1' if lazy else '0')
+    code = f'import sys, backend; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    completed = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, env=env,
+                               capture_output=True, text=True, check=True)
+    # Logging goes to stderr, so stdout only holds the module list
+    return [name for name in completed.stdout.strip().split(',') if name]
+
+
+def bench_startup(results):
+    print("⏱️  Backend startup in a fresh interpreter")
+    loaded = import_backend(lazy=True)
+    if loaded:
+        raise RuntimeError(f"LAZY_STARTUP=1 imported {', '.join(loaded)} at startup")
+
+    run(results, 'startup[lazy]', lambda: import_backend(lazy=True), 1)
+    run(results, 'startup[warmup]', lambda: import_backend(lazy=False), 1)
+
+
+def check_thresholds(results, thresholds):
+    """Return a list of regressions against the configured thresholds"""
+    regressions = []
+    for name, limits in thresholds.items():
+        result = results.get(name)
+        if result is None:
+            continue
+        if 'min_throughput' in limits and result['throughput'] < limits['min_throughput']:
+            regressions.append({'benchmark': name, 'metric': 'throughput',
+                                'value': result['throughput'], 'threshold': limits['min_throughput']})
+        if 'max_p99_ms' in limits and result['p99_ms'] > limits['max_p99_ms']:
+            regressions.append({'benchmark': name, 'metric': 'p99_ms',
+                                'value': result['p99_ms'], 'threshold': limits['max_p99_ms']})
+    return regressions
+
+
+def calibrated_thresholds(results):
+    """Thresholds derived from a run, loosened by CALIBRATION_MARGIN"""
+    return {name: {'min_throughput': round(result['throughput'] * (1 - CALIBRATION_MARGIN), 2),
+                   'max_p99_ms': round(result['p99_ms'] * (1 + 1 / CALIBRATION_MARGIN) + P99_SLACK_MS, 3)}
+            for name, result in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument('--quick', action='store_true', help="small batch sizes and the 1k-row CSV only")
+    parser.add_argument('--output', default=RESULTS_PATH, help="where to write the JSON results")
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH, help="thresholds file to check against")
+    parser.add_argument('--calibrate', action='store_true', help="rewrite the thresholds file from this run")
+    args = parser.parse_args()
+
+    thresholds = {}
+    if os.path.exists(args.thresholds) and not args.calibrate:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+
+    failures = check_scorers(backend.MODEL_PATHS)
+
+    server, base_url = start_stub_server()
+    results = {}
+    try:
+        bench_model_stages(results, QUICK_BATCH_SIZES if args.quick else BATCH_SIZES)
+        bench_scrapers(results, base_url)
+        bench_crawl(results, base_url)
+        bench_routes(results, base_url, QUICK_CSV_ROWS if args.quick else CSV_ROWS)
+        bench_startup(results)
+
+        # A single noisy measurement shouldn't block a deploy: re-measure
+        # each regressed benchmark once and keep the second result
+        regressions = check_thresholds(results, thresholds)
+        for name in sorted({regression['benchmark'] for regression in regressions}):
+            print(f"🔁 Re-measuring {name}")
+            fn, items_per_call, kwargs = _benchmarks[name]
+            results[name] = measure(fn, items_per_call, **kwargs)
+        regressions = check_thresholds(results, thresholds)
+    finally:
+        server.shutdown()
+
+    if args.calibrate:
+        with open(args.thresholds, 'w') as f:
+            json.dump(calibrated_thresholds(results), f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"✅ Wrote thresholds to {args.thresholds}")
+
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sklearn': sklearn.__version__,
+            'model_type': type(backend.current_models()['tfidf']).__name__,
+            'model_version': backend.current_models()['version'],
+        },
+        'benchmarks': results,
+        'regressions': regressions,
+        'equivalence_failures': failures,
+        'passed': not regressions and not failures,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    for name, result in results.items():
+        print(f"{name:40s} {result['throughput']:>14,.1f} items/s   p99 {result['p99_ms']:>10.2f} ms")
+    print(f"\n📄 Results written to {args.output}")
+    for regression in regressions:
+        print(f"❌ {regression['benchmark']}: {regression['metric']} {regression['value']} "
+              f"(threshold {regression['threshold']})")
+    for failure in failures:
+        print(f"❌ {failure['benchmark']}: {failure['message']}")
+    if regressions or failures:
+        sys.exit(1)
+    print("✅ No regressions")
+
+
+if __name__ == '__main__':
+    main()
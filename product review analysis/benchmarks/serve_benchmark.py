@@ -0,0 +1,182 @@
+"""
+Serving benchmark: memory per worker and requests/sec
+Starts the app three ways on a local port: the Flask dev server, plain
+gunicorn (every worker imports and warms up the backend itself) and
+serve.py (loaded once in the master, GC frozen, workers forked). Each is
+driven with concurrent /api/predict requests for a fixed time. Afterwards
+the RSS, PSS and private memory of every server process is read from
+/proc/<pid>/smaps_rollup (Linux only). PSS splits shared pages between the
+processes sharing them, so the total PSS is the real memory cost of a
+configuration.
+
+Usage:
+    python benchmarks/serve_benchmark.py
+    python benchmarks/serve_benchmark.py --workers 8 --threads 4 --seconds 20
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_PATH = os.path.join(BENCH_DIR, 'serve_results.json')
+
+# Small batches, as sent by interactive clients
+PAYLOAD = {'reviews': ['Great product, works perfectly! :)', 'Stopped working after a week, waste of money',
+                       'Battery lasts long and the screen is bright', 'Arrived damaged, terrible support']}
+# Seconds to wait for a server to answer its first request
+STARTUP_TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_commands(port, workers, threads):
+    bind = f'127.0.0.1:{port}'
+    return {
+        'dev server': [sys.executable, '-c',
+                       f'import backend; backend.app.run(port={port}, threaded=True, use_reloader=False)'],
+        'gunicorn (no preload)': [sys.executable, '-m', 'gunicorn', '--bind', bind, '--workers', str(workers),
+                                  '--threads', str(threads), 'backend:app'],
+        'serve.py': [sys.executable, 'serve.py', '--bind', bind, '--workers', str(workers),
+                     '--threads', str(threads), '--pidfile', os.path.join(BENCH_DIR, f'.serve-{port}.pid')],
+    }
+
+
+def wait_until_ready(url, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            if requests.post(url, json=PAYLOAD, timeout=5).status_code == 200:
+                return
+        except (requests.ConnectionError, requests.Timeout):
+            # Connections queue in the listen backlog while workers load
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not answer within {STARTUP_TIMEOUT}s")
+
+
+def drive(url, clients, seconds):
+    """POST the payload from several client threads; returns (requests, errors, elapsed)"""
+    counts = [[0, 0] for _ in range(clients)]
+    stop = time.monotonic() + seconds
+
+    def client(count):
+        session = requests.Session()
+        while time.monotonic() < stop:
+            response = session.post(url, json=PAYLOAD, timeout=30)
+            count[0 if response.status_code == 200 else 1] += 1
+
+    threads = [threading.Thread(target=client, args=(count,)) for count in counts]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(c[0] for c in counts), sum(c[1] for c in counts), time.monotonic() - started
+
+
+def process_tree(pid):
+    """pid and all of its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces; fields after it are fixed
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def memory(pid):
+    """RSS, PSS and private (unshared) memory of a process in MiB"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss_mb': round(values['Rss'], 1), 'pss_mb': round(values['Pss'], 1),
+            'private_mb': round(values['Private_Clean'] + values['Private_Dirty'], 1)}
+
+
+def bench_server(name, command, port, clients, seconds):
+    print(f"⏱️  {name}")
+    env = dict(os.environ, LOG_LEVEL='WARNING', PREDICTION_CACHE_ENABLED='0',
+               REVIEW_STORE_ENABLED='0', SCRAPE_CACHE_ENABLED='0')
+    process = subprocess.Popen(command, cwd=PROJECT_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/api/predict'
+    try:
+        started = time.monotonic()
+        wait_until_ready(url, process)
+        ready_s = time.monotonic() - started
+        done, errors, elapsed = drive(url, clients, seconds)
+        # Measured after the load so workers have touched what requests use
+        processes = {pid: memory(pid) for pid in process_tree(process.pid)}
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    # gunicorn's master only supervises; workers are its children
+    workers = [usage for pid, usage in processes.items() if pid != process.pid] or list(processes.values())
+    return {
+        'ready_s': round(ready_s, 2),
+        'requests_per_s': round(done / elapsed, 1),
+        'errors': errors,
+        'processes': len(processes),
+        'worker_rss_mb': round(sum(w['rss_mb'] for w in workers) / len(workers), 1),
+        'worker_private_mb': round(sum(w['private_mb'] for w in workers) / len(workers), 1),
+        'total_pss_mb': round(sum(p['pss_mb'] for p in processes.values()), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory and throughput of the ways to serve the app")
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent client threads")
+    parser.add_argument('--seconds', type=float, default=10, help="load duration per server")
+    parser.add_argument('--output', default=RESULTS_PATH, help="where to write the JSON results")
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        sys.exit("❌ Memory is read from /proc/<pid>/smaps_rollup, which needs Linux 4.14+")
+
+    results = {}
+    port = free_port()
+    for name, command in server_commands(port, args.workers, args.threads).items():
+        results[name] = bench_server(name, command, port, args.clients, args.seconds)
+
+    with open(args.output, 'w') as f:
+        json.dump({'workers': args.workers, 'threads': args.threads, 'clients': args.clients,
+                   'results': results}, f, indent=2)
+
+    print()
+    print(f"{'':24s} {'req/s':>8s} {'worker RSS':>11s} {'private':>9s} {'total PSS':>10s} {'ready':>7s}")
+    for name, result in results.items():
+        print(f"{name:24s} {result['requests_per_s']:>8.1f} {result['worker_rss_mb']:>8.1f} MB "
+              f"{result['worker_private_mb']:>6.1f} MB {result['total_pss_mb']:>7.1f} MB {result['ready_s']:>6.1f}s")
+    print(f"\n📄 Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+On-disk cache of preprocessed training text
+Preprocessing (regex cleanup, stopword filtering, Porter stemming) is the
+slowest part of retraining, and its output only depends on the input text
+and the preprocessing code. The training scripts store the preprocessed
+review column as npz shards (one UTF-8 blob plus character offsets per
+chunk), keyed by a content hash of the source data, the column name and the
+preprocessing version. Later runs read the shards instead of recomputing.
+
+Fitted TF-IDF matrices can be cached the same way (see load_features and
+save_features), keyed by the corpus key, the vectorizer parameters and the
+scikit-learn, NumPy and SciPy versions.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import nltk
+import numpy as np
+from text_preprocessing import PREPROCESSING_VERSION, stopwords_set
+
+CORPUS_CACHE_ENABLED = os.environ.get('CORPUS_CACHE_ENABLED', '1') == '1'
+# A relative path is resolved against the app directory, like MODEL_DIR
+CORPUS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.environ.get('CORPUS_CACHE_DIR', 'cache/corpus'))
+
+_HASH_BLOCK = 1024 * 1024
+
+
+def file_digest(path):
+    """Content hash of a file, read in blocks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def texts_digest(texts):
+    """Content hash of an in-memory list of texts"""
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        encoded = text.encode('utf-8', 'surrogatepass')
+        digest.update(len(encoded).to_bytes(8, 'little'))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def preprocessing_fingerprint():
+    """Identifies everything that determines preprocessing() output"""
+    stopwords_hash = hashlib.blake2b('\n'.join(sorted(stopwords_set)).encode('utf-8'), digest_size=8).hexdigest()
+    return f'v{PREPROCESSING_VERSION}-nltk{nltk.__version__}-stopwords{stopwords_hash}'
+
+
+def corpus_key(source_digest, column):
+    """Cache key for the preprocessed column of one data source"""
+    parts = [source_digest, column, preprocessing_fingerprint()]
+    return hashlib.blake2b('\0'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _save_part(path, texts):
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    blob = ''.join(texts).encode('utf-8', 'surrogatepass')
+    np.savez(path, blob=np.frombuffer(blob, dtype=np.uint8), lengths=lengths)
+
+
+def _load_part(path):
+    with np.load(path) as part:
+        text = part['blob'].tobytes().decode('utf-8', 'surrogatepass')
+        ends = np.cumsum(part['lengths']).tolist()
+    starts = [0] + ends[:-1]
+    return [text[start:end] for start, end in zip(starts, ends)]
+
+
+def _publish(tmp_dir, final_dir):
+    """Move a fully written cache entry into place (another writer may have won)"""
+    try:
+        os.replace(tmp_dir, final_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class CorpusStream:
+    """
+    Preprocess text chunk by chunk, reading from or filling the corpus cache
+
+    Call process() with each chunk of raw texts in source order, then
+    close(). On a cache hit the preprocessed texts come from the stored
+    shards, whatever chunk size the earlier run used; on a miss each chunk
+    is preprocessed and written, and close() publishes the entry.
+    """
+
+    def __init__(self, source_digest, column, preprocess, directory=CORPUS_CACHE_DIR):
+        self.key = corpus_key(source_digest, column)
+        self.preprocess = preprocess
+        self.path = os.path.join(directory, self.key)
+        self.enabled = CORPUS_CACHE_ENABLED
+        self.hit = self.enabled and os.path.exists(os.path.join(self.path, 'manifest.json'))
+        self.rows = 0
+
+        self._parts = []
+        self._buffer = []
+        if self.hit:
+            with open(os.path.join(self.path, 'manifest.json')) as f:
+                self._parts = [os.path.join(self.path, name) for name in json.load(f)['parts']]
+        elif self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._tmp = f'{self.path}.tmp-{os.getpid()}'
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            os.makedirs(self._tmp)
+            self._written = []
+
+    def process(self, texts):
+        """Return the preprocessed form of the next chunk of raw texts"""
+        texts = list(texts)
+        self.rows += len(texts)
+        if self.hit:
+            while len(self._buffer) < len(texts) and self._parts:
+                self._buffer.extend(_load_part(self._parts.pop(0)))
+            if len(self._buffer) < len(texts):
+                raise ValueError(f"Corpus cache {self.path} has fewer rows than the source")
+            processed, self._buffer = self._buffer[:len(texts)], self._buffer[len(texts):]
+            return processed
+
+        processed = self.preprocess(texts)
+        if self.enabled:
+            name = f'part-{len(self._written):05d}.npz'
+            _save_part(os.path.join(self._tmp, name), processed)
+            self._written.append(name)
+        return processed
+
+    def close(self):
+        """Publish a newly written entry; call once every chunk has been processed"""
+        if self.enabled and not self.hit:
+            with open(os.path.join(self._tmp, 'manifest.json'), 'w') as f:
+                json.dump({'parts': self._written, 'rows': self.rows,
+                           'preprocessing': preprocessing_fingerprint()}, f)
+            _publish(self._tmp, self.path)
+
+    def abort(self):
+        """Discard a partially written entry"""
+        if self.enabled and not self.hit:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+def preprocess_cached(texts, source_digest, column, preprocess):
+    """Preprocess a whole column in one go through the corpus cache; returns (processed, hit)"""
+    stream = CorpusStream(source_digest, column, preprocess)
+    try:
+        processed = stream.process(texts)
+    except BaseException:
+        stream.abort()
+        raise
+    stream.close()
+    return processed, stream.hit
+
+
+def features_key(corpus, vectorizer, **split):
+    """Cache key for matrices fitted by vectorizer on a cached corpus and split"""
+    import scipy
+    import sklearn
+
+    params = sorted((name, repr(value)) for name, value in vectorizer.get_params().items())
+    # A vectorizer pickled under other library versions must be refitted,
+    # which is what upgrading the models is for
+    versions = [f'sklearn{sklearn.__version__}', f'numpy{np.__version__}', f'scipy{scipy.__version__}']
+    description = json.dumps([corpus, type(vectorizer).__name__, params, sorted(split.items()), versions])
+    return 'features-' + hashlib.blake2b(description.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def load_features(key, directory=CORPUS_CACHE_DIR):
+    """Return (fitted vectorizer, {name: sparse matrix}) for a features key, or None"""
+    from scipy.sparse import load_npz
+
+    path = os.path.join(directory, key)
+    if not CORPUS_CACHE_ENABLED or not os.path.exists(os.path.join(path, 'manifest.json')):
+        return None
+    with open(os.path.join(path, 'manifest.json')) as f:
+        names = json.load(f)['matrices']
+    with open(os.path.join(path, 'vectorizer.pkl'), 'rb') as f:
+        vectorizer = pickle.load(f)
+    return vectorizer, {name: load_npz(os.path.join(path, f'{name}.npz')) for name in names}
+
+
+def save_features(key, vectorizer, matrices, directory=CORPUS_CACHE_DIR):
+    """Store a fitted vectorizer and its sparse matrices under a features key"""
+    from scipy.sparse import save_npz
+
+    if not CORPUS_CACHE_ENABLED:
+        return
+    path = os.path.join(directory, key)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, 'vectorizer.pkl'), 'wb') as f:
+        pickle.dump(vectorizer, f)
+    for name, matrix in matrices.items():
+        save_npz(os.path.join(tmp, f'{name}.npz'), matrix, compressed=False)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump({'matrices': sorted(matrices)}, f)
+    _publish(tmp, path)
@@ -0,0 +1,237 @@
+"""
+Bulk review crawling
+Crawls thousands of product URLs with the same page fetching and review
+extraction as scraper.py, but through a scheduler built for long batch
+runs rather than one web request. Every host gets its own queue, a
+concurrency limit and a request rate limit. Pages answered with 429 or 503,
+or that fail to connect, are retried with exponential backoff (honouring
+Retry-After), and the whole host slows down while it backs off. Connections
+are kept alive in one pooled session.
+
+Finished products are appended to a JSON Lines file as they complete. The
+file doubles as the checkpoint: an interrupted crawl started again with the
+same output skips every product already in it.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from dedup import make_deduplicator
+from metrics import scrape_stage_seconds, scraped_reviews, scrape_failures
+from scraper import (AMAZON_HEADERS, GENERIC_HEADERS, REQUEST_TIMEOUT, amazon_review_page_urls,
+                     extract_amazon_reviews, extract_generic_reviews, site_for)
+
+logger = logging.getLogger(__name__)
+
+# Pages fetched at the same time across all hosts
+CRAWL_WORKERS = int(os.environ.get('CRAWL_WORKERS', 32))
+# Pages fetched at the same time from one host
+CRAWL_HOST_CONCURRENCY = int(os.environ.get('CRAWL_HOST_CONCURRENCY', 4))
+# Requests started per second against one host; 0 means no limit
+CRAWL_HOST_RATE = float(os.environ.get('CRAWL_HOST_RATE', 2))
+# Retries of a page answered with 429/503 or failing to connect
+CRAWL_RETRIES = int(os.environ.get('CRAWL_RETRIES', 4))
+# First retry delay in seconds, doubled on every further retry
+CRAWL_BACKOFF = float(os.environ.get('CRAWL_BACKOFF', 1))
+CRAWL_MAX_BACKOFF = float(os.environ.get('CRAWL_MAX_BACKOFF', 60))
+
+RETRY_STATUSES = (429, 503)
+
+
+class _Host:
+    """Queued pages and limiter state for one host"""
+
+    def __init__(self):
+        self.queue = deque()
+        self.active = 0
+        self.next_at = 0.0
+
+
+class _Product:
+    def __init__(self, url, site, page_urls):
+        self.url = url
+        self.site = site
+        self.headers = AMAZON_HEADERS if site == 'amazon' else GENERIC_HEADERS
+        self.pages = [None] * len(page_urls)
+        self.remaining = len(page_urls)
+        self.errors = []
+
+
+class _Throttled(Exception):
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header, if given as a number"""
+    try:
+        return max(float(response.headers.get('Retry-After', '')), 0)
+    except ValueError:
+        return None
+
+
+class CrawlScheduler:
+    """Fetches product pages under per-host concurrency and rate limits, retrying throttled pages"""
+
+    def __init__(self, workers=CRAWL_WORKERS, host_concurrency=CRAWL_HOST_CONCURRENCY, host_rate=CRAWL_HOST_RATE,
+                 retries=CRAWL_RETRIES, backoff=CRAWL_BACKOFF, max_backoff=CRAWL_MAX_BACKOFF):
+        self.workers = workers
+        self.host_concurrency = host_concurrency
+        self.interval = 1 / host_rate if host_rate > 0 else 0.0
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.counters = {'pages': 0, 'retries': 0, 'failed_pages': 0}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(workers, 10), pool_maxsize=host_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _fetch(self, product, page_url, max_reviews):
+        """Worker: fetch and extract one page; raises _Throttled if it should be retried"""
+        try:
+            with scrape_stage_seconds.time(stage='fetch', site=product.site):
+                response = self.session.get(page_url, headers=product.headers, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _Throttled(f'{type(e).__name__}: {e}')
+        if response.status_code in RETRY_STATUSES:
+            scrape_failures.inc(site=product.site, reason='throttled')
+            raise _Throttled(f'HTTP {response.status_code}', _retry_after(response))
+
+        logger.debug("crawler - Response status %s for %s", response.status_code, page_url)
+        if response.status_code != 200:
+            scrape_failures.inc(site=product.site, reason='http_status')
+        if product.site == 'amazon':
+            reviews = extract_amazon_reviews(response.content, max_reviews)
+        else:
+            reviews = extract_generic_reviews(response.content, max_reviews)
+        if response.status_code == 200 and not reviews:
+            scrape_failures.inc(site=product.site, reason='no_reviews')
+        return reviews
+
+    def _delay(self, attempt, retry_after):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # Jitter keeps retries of many pages from arriving together
+        return random.uniform(0.5, 1) * min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    def crawl(self, urls, max_reviews=50):
+        """
+        Crawl every product URL; yields (url, reviews, error) as products finish
+
+        Products finish in completion order, not input order. error is None
+        unless no page of the product could be fetched and parsed.
+        """
+        products = {}
+        hosts = {}
+        for index, url in enumerate(urls):
+            site = site_for(url)
+            page_urls = amazon_review_page_urls(url) if site == 'amazon' else [url]
+            products[index] = _Product(url, site, page_urls)
+            for page, page_url in enumerate(page_urls):
+                host = hosts.setdefault(urlsplit(page_url).netloc.lower(), _Host())
+                host.queue.append((index, page, page_url, 0))
+
+        completed = queue.SimpleQueue()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawl')
+        in_flight = 0
+        try:
+            while products:
+                now = time.monotonic()
+                wake = None
+                for name, host in hosts.items():
+                    while host.queue and host.active < self.host_concurrency and in_flight < self.workers:
+                        if host.next_at > now:
+                            wake = host.next_at if wake is None else min(wake, host.next_at)
+                            break
+                        task = host.queue.popleft()
+                        host.active += 1
+                        in_flight += 1
+                        host.next_at = max(host.next_at, now) + self.interval
+                        future = executor.submit(self._fetch, products[task[0]], task[2], max_reviews)
+                        future.add_done_callback(lambda f, name=name, task=task: completed.put((name, task, f)))
+
+                try:
+                    name, (index, page, page_url, attempt), future = completed.get(
+                        timeout=None if wake is None else max(wake - now, 0))
+                except queue.Empty:
+                    continue
+                host = hosts[name]
+                host.active -= 1
+                in_flight -= 1
+                product = products[index]
+                self.counters['pages'] += 1
+
+                try:
+                    product.pages[page] = future.result()
+                except _Throttled as e:
+                    if attempt < self.retries:
+                        delay = self._delay(attempt, e.retry_after)
+                        logger.info("Retrying %s in %.1fs (%s)", page_url, delay, e)
+                        self.counters['retries'] += 1
+                        # Back off the whole host, not just this page
+                        host.next_at = max(host.next_at, time.monotonic() + delay)
+                        host.queue.appendleft((index, page, page_url, attempt + 1))
+                        continue
+                    product.errors.append(f'{e} after {attempt} retries')
+                    self.counters['failed_pages'] += 1
+                except Exception as e:
+                    logger.exception("Error crawling %s", page_url)
+                    scrape_failures.inc(site=product.site, reason='error')
+                    product.errors.append(str(e))
+                    self.counters['failed_pages'] += 1
+
+                product.remaining -= 1
+                if product.remaining == 0:
+                    del products[index]
+                    yield self._finish(product, max_reviews)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, product, max_reviews):
+        # Pages were extracted separately, so repeats across pages are removed here
+        page_reviews = [review for reviews in product.pages if reviews for review in reviews]
+        reviews = make_deduplicator(product.site).filter(page_reviews)[:max_reviews]
+        scraped_reviews.inc(len(reviews), site=product.site)
+        error = '; '.join(product.errors) if product.errors and not reviews else None
+        return product.url, reviews, error
+
+
+def read_checkpoint(path):
+    """
+    Return {url: record} for the products already in a crawl output file
+
+    A partly written last line (from an interrupted run) is cut off so the
+    file can be appended to again. Later records of a URL replace earlier
+    ones.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            logger.warning("Dropping a partly written record at the end of %s", path)
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        if line.strip():
+            record = json.loads(line)
+            records[record['url']] = record
+    return records
+
+
+def write_record(f, url, product, reviews, error=None):
+    """Append one finished product to a crawl output file and flush it"""
+    f.write(json.dumps({'url': url, 'product_id': product, 'reviews': reviews, 'error': error},
+                       ensure_ascii=False) + '\n')
+    f.flush()
@@ -0,0 +1,229 @@
+"""
+Exact and near-duplicate review filtering
+Scrapers see the same review through overlapping selectors and across
+review pages, often with different whitespace or punctuation, and uploaded
+CSVs repeat rows. Duplicates waste prediction work and skew the positive
+percentage, so every review source goes through a ReviewDeduplicator.
+
+Exact duplicates (after case, whitespace and punctuation normalization) are
+caught with a set of text hashes. Near-duplicates are caught with MinHash
+signatures over byte 4-gram shingles, indexed with locality-sensitive hashing
+(LSH) bands so each review is only compared against likely matches.
+Candidates are confirmed by comparing their full signatures, which estimate
+the shingle Jaccard similarity.
+"""
+
+import hashlib
+import os
+import re
+import numpy as np
+from metrics import duplicate_reviews
+
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', '1') == '1'
+# Jaccard similarity of character shingles at which two reviews count as
+# the same review; 1 keeps only the exact-duplicate check
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.85))
+DEDUP_NUM_PERM = int(os.environ.get('DEDUP_NUM_PERM', 64))
+# Reviews remembered by one deduplicator, in both the exact-duplicate set and
+# the near-duplicate index (about 700 bytes each). Later reviews are still
+# checked against the first ones but not added, which bounds memory on very
+# large uploads; duplicates of reviews past this window are not caught
+DEDUP_MAX_INDEXED = int(os.environ.get('DEDUP_MAX_INDEXED', 50000))
+
+# Shingles are byte 4-grams of the normalized text, packed into a uint32
+SHINGLE_BYTES = 4
+# Texts whose signatures are computed in one vectorized pass
+BATCH_SIZE = 1024
+
+non_word_pattern = re.compile(r'[\W_]+')
+
+_rng = np.random.default_rng(0x5EED)
+# Hash family h(x) = a * x + b (mod 2**32) with odd a, applied to mixed shingles
+_hash_a = (_rng.integers(0, 2 ** 32, size=DEDUP_NUM_PERM, dtype=np.uint32) | np.uint32(1))[:, None]
+_hash_b = _rng.integers(0, 2 ** 32, size=DEDUP_NUM_PERM, dtype=np.uint32)[:, None]
+# Folds each band of a signature into a single bucket key
+_band_mix = _rng.integers(0, 2 ** 63, size=DEDUP_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+
+
+def _mix(values):
+    """murmur3 32-bit finalizer, so that similar byte windows hash far apart"""
+    values = values ^ (values >> np.uint32(16))
+    values *= np.uint32(0x85EBCA6B)
+    values ^= values >> np.uint32(13)
+    values *= np.uint32(0xC2B2AE35)
+    values ^= values >> np.uint32(16)
+    return values
+
+
+def normalize_text(text):
+    """Lowercase and reduce punctuation and whitespace runs to single spaces"""
+    return non_word_pattern.sub(' ', text.lower()).strip()
+
+
+def signatures(normalized_texts):
+    """
+    MinHash signatures for a batch of normalized, non-empty texts
+
+    Returns a (len(texts), DEDUP_NUM_PERM) uint32 array, computed for the
+    whole batch at once.
+    """
+    encoded = [text.encode('utf-8', 'surrogatepass').ljust(SHINGLE_BYTES, b'\0') for text in normalized_texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint32)
+    # Every 4-byte window of the joined batch, then only those inside one text
+    packed = data[:-3] | (data[1:-2] << 8) | (data[2:-1] << 16) | (data[3:] << 24)
+    counts = lengths - (SHINGLE_BYTES - 1)
+    first_window = np.cumsum(counts) - counts
+    text_starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(text_starts - first_window, counts) + np.arange(counts.sum())
+    values = _mix(packed[positions])
+
+    # One row per hash function, so each reduction runs over contiguous memory
+    hashed = _hash_a * values
+    hashed += _hash_b
+    return np.ascontiguousarray(np.minimum.reduceat(hashed, first_window, axis=1).T)
+
+
+def lsh_bands(threshold, num_perm=DEDUP_NUM_PERM):
+    """
+    Pick (bands, rows) with bands * rows == num_perm for a similarity threshold
+
+    Two signatures collide in some band with probability 1 - (1 - s**rows)**bands,
+    which rises steeply around (1 / bands) ** (1 / rows). The split whose
+    midpoint sits just below the threshold is used, so near-duplicates are
+    rarely missed; false candidates are removed by the signature comparison.
+    """
+    splits = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in splits if (1 / bands) ** (1 / rows) <= threshold]
+    return max(below or splits[:1], key=lambda split: (1 / split[0]) ** (1 / split[1]))
+
+
+class ReviewDeduplicator:
+    """
+    Keeps the first occurrence of each review, dropping exact and near duplicates
+
+    One instance covers one review source (a scraped product or an uploaded
+    file), and state carries across calls, e.g. from one CSV chunk to the
+    next. Lookups are O(1) on average for both checks. Not thread-safe.
+    """
+
+    def __init__(self, source='generic', threshold=DEDUP_THRESHOLD, max_indexed=DEDUP_MAX_INDEXED):
+        self.source = source
+        self.threshold = threshold
+        self.max_indexed = max_indexed
+        self.near_enabled = threshold < 1
+        self.bands, self.rows = lsh_bands(threshold) if self.near_enabled else (0, 0)
+        self.counters = {'kept': 0, 'exact': 0, 'near': 0}
+        self._digests = set()
+        # Band key -> first indexed review with that band; the per-position
+        # multipliers keep keys of different bands apart in one dict
+        self._buckets = {}
+        self._signatures = np.empty((0, DEDUP_NUM_PERM), dtype=np.uint32)
+        self._indexed = 0
+
+    def filter(self, texts):
+        """Return the texts that are not duplicates of each other or of earlier ones, in order"""
+        texts = list(texts)
+        keep = []
+        for start in range(0, len(texts), BATCH_SIZE):
+            keep.extend(self._filter_batch(texts[start:start + BATCH_SIZE]))
+        return [text for text, kept in zip(texts, keep) if kept]
+
+    def add(self, text):
+        """Record one review; returns False if it duplicates one seen before"""
+        return self._filter_batch([text])[0]
+
+    def _filter_batch(self, texts):
+        keep = [False] * len(texts)
+        exact = near = 0
+        unseen = []
+        for i, text in enumerate(texts):
+            normalized = normalize_text(text)
+            digest = hashlib.blake2b(normalized.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+            if digest in self._digests:
+                exact += 1
+                continue
+            if len(self._digests) < self.max_indexed:
+                self._digests.add(digest)
+            keep[i] = True
+            if self.near_enabled and normalized:
+                unseen.append((i, normalized))
+
+        if unseen:
+            flags = self._near_duplicates(signatures([normalized for _, normalized in unseen]))
+            for (i, _), is_near in zip(unseen, flags):
+                if is_near:
+                    keep[i] = False
+                    near += 1
+
+        self.counters['kept'] += sum(keep)
+        for kind, count in (('exact', exact), ('near', near)):
+            if count:
+                self.counters[kind] += count
+                duplicate_reviews.inc(count, source=self.source, kind=kind)
+        return keep
+
+    def _near_duplicates(self, batch):
+        """
+        Flag each signature in batch that nearly matches an earlier one
+
+        Every signature is indexed (up to max_indexed), near duplicates
+        included, so candidate lookups don't depend on earlier verdicts and
+        all candidates of the batch are verified in one vectorized step.
+        """
+        mixed = batch.astype(np.uint64) * _band_mix
+        band_keys = mixed.reshape(len(batch), self.bands, self.rows).sum(axis=2).tolist()
+
+        first = self._indexed
+        indexed = max(min(len(batch), self.max_indexed - first), 0)
+        if first + indexed > len(self._signatures):
+            grown = np.empty((max(2 * len(self._signatures), first + indexed, 1024), DEDUP_NUM_PERM), dtype=np.uint32)
+            grown[:first] = self._signatures[:first]
+            self._signatures = grown
+        self._signatures[first:first + indexed] = batch[:indexed]
+        self._indexed += indexed
+
+        buckets = self._buckets
+        pair_rows = []
+        pair_candidates = []
+        for row, keys in enumerate(band_keys):
+            if row < indexed:
+                index = first + row
+                candidates = {buckets.setdefault(key, index) for key in keys}
+                candidates.discard(index)
+            else:
+                candidates = {buckets.get(key) for key in keys}
+                candidates.discard(None)
+            if candidates:
+                pair_rows.extend([row] * len(candidates))
+                pair_candidates.extend(candidates)
+
+        flags = np.zeros(len(batch), dtype=bool)
+        if pair_rows:
+            rows = np.array(pair_rows)
+            # Share of equal MinHash values estimates the Jaccard similarity
+            equal = (self._signatures[pair_candidates] == batch[rows]).sum(axis=1)
+            flags[rows[equal >= self.threshold * DEDUP_NUM_PERM]] = True
+        return flags.tolist()
+
+    @property
+    def removed(self):
+        return self.counters['exact'] + self.counters['near']
+
+
+class _KeepAll:
+    """Stand-in used when DEDUP_ENABLED=0"""
+
+    counters = {'kept': 0, 'exact': 0, 'near': 0}
+    removed = 0
+
+    def add(self, text):
+        return True
+
+    def filter(self, texts):
+        return list(texts)
+
+
+def make_deduplicator(source='generic'):
+    """New deduplicator for one review source (amazon, generic, csv), honouring DEDUP_ENABLED"""
+    return ReviewDeduplicator(source) if DEDUP_ENABLED else _KeepAll()
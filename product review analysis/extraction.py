@@ -0,0 +1,141 @@
+"""
+Single-pass HTML extraction for the review scrapers
+All selectors for a site are compiled into one filter. The page is parsed
+with that filter as parse_only, so Beautiful Soup only builds Tag objects for
+candidate elements (and their contents), and the candidates are then
+classified against every selector in one walk instead of one find_all per
+selector.
+
+Selectors use the same (tag names, attrs) shape as find_all(), and match
+the same way: attribute values are compared exactly or searched with a
+compiled regex, and multi-valued attributes such as class match on any
+single value or on the whole space-joined value.
+"""
+
+from bs4 import BeautifulSoup, Tag
+from bs4.builder import HTMLTreeBuilder
+from bs4.filter import ElementFilter
+from metrics import scrape_stage_seconds
+
+# Attributes Beautiful Soup treats as whitespace-separated lists
+MULTI_VALUED_ATTRIBUTES = frozenset(['class', 'rel', 'rev', 'accept-charset', 'headers', 'accesskey', 'dropzone'])
+
+
+def _attribute_values(attr, value):
+    if value is None:
+        return ()
+    if isinstance(value, list):
+        values = value
+    elif attr in MULTI_VALUED_ATTRIBUTES:
+        # Raw values seen during parsing have not been split yet
+        values = value.split()
+    else:
+        return (value,)
+    if len(values) == 1:
+        return values
+    return list(values) + [' '.join(values)]
+
+
+def _value_matches(values, rule):
+    if isinstance(rule, str):
+        return rule in values
+    return any(rule.search(value) for value in values)
+
+
+class _CandidateSoup(BeautifulSoup):
+    """
+    BeautifulSoup that keeps the names of tags skipped by parse_only
+
+    With parse_only, an end tag for a skipped ancestor would otherwise be
+    ignored and leave an unclosed candidate open, swallowing the rest of
+    the page. Tracking the skipped stack lets such an end tag close the
+    candidate exactly where a full parse would.
+    """
+
+    def reset(self):
+        super().reset()
+        self.skipped_stack = []
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs, *args, **kwargs):
+        tag = super().handle_starttag(name, namespace, nsprefix, attrs, *args, **kwargs)
+        if tag is None:
+            self.skipped_stack.append(name)
+        return tag
+
+    def handle_endtag(self, name, nsprefix=None):
+        if not self.open_tag_counter.get(name) and name in self.skipped_stack:
+            # The most recent open tag of this name is a skipped ancestor:
+            # close everything above it, including any open candidate
+            self.endData()
+            while len(self.tagStack) > 1:
+                self.popTag()
+            index = len(self.skipped_stack) - 1 - self.skipped_stack[::-1].index(name)
+            del self.skipped_stack[index:]
+            return
+        super().handle_endtag(name, nsprefix)
+
+
+class CompiledSelectors(ElementFilter):
+    """A set of find_all-style selectors evaluated in a single parse and walk"""
+
+    def __init__(self, selectors, site='generic'):
+        super().__init__()
+        # Label for the parse/select timings in /metrics
+        self.site = site
+        self.selectors = []
+        # Tag name -> [(selector index, attribute rules)], so each candidate
+        # tag is only checked against selectors for its own name
+        self.by_name = {}
+        for index, (names, attrs) in enumerate(selectors):
+            if isinstance(names, str):
+                names = [names]
+            rules = list(attrs.items())
+            self.selectors.append((frozenset(names), rules))
+            for name in names:
+                self.by_name.setdefault(name, []).append((index, rules))
+        self.tag_names = frozenset(self.by_name)
+
+    @property
+    def includes_everything(self):
+        return False
+
+    def _matching(self, name, attrs):
+        """Yield the index of every selector the tag matches"""
+        for index, rules in self.by_name.get(name, ()):
+            for attr, rule in rules:
+                if not _value_matches(_attribute_values(attr, attrs.get(attr)), rule):
+                    break
+            else:
+                yield index
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        if name in HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS:
+            # Void elements are cheap and are always built so that html.parser's
+            # bookkeeping for their end tags matches a full parse
+            return True
+        if name not in self.tag_names:
+            return False
+        for _ in self._matching(name, attrs or {}):
+            return True
+        return False
+
+    def allow_string_creation(self, string):
+        # Text only matters inside candidate elements
+        return False
+
+    def select(self, html):
+        """
+        Parse html once and return one list of matching elements per selector
+
+        Each list is in document order, the same as soup.find_all() would
+        return for that selector.
+        """
+        with scrape_stage_seconds.time(stage='parse', site=self.site):
+            soup = _CandidateSoup(html, 'html.parser', parse_only=self)
+        with scrape_stage_seconds.time(stage='select', site=self.site):
+            matches = [[] for _ in self.selectors]
+            for element in soup.descendants:
+                if isinstance(element, Tag) and element.name in self.tag_names:
+                    for index in self._matching(element.name, element.attrs):
+                        matches[index].append(element)
+        return matches
@@ -0,0 +1,165 @@
+"""
+Fused TF-IDF + logistic regression scorer
+The served model is linear, so a review's score is
+    intercept + (sum over its n-grams of tf * idf * coef) / ||tf * idf||
+This module computes that directly per review: n-grams are looked up in
+the vocabulary, weighted by IDF, normalized and dotted with the coefficient
+vector, without building a sparse matrix or going through sklearn's input
+validation. That per-call overhead dominates when scoring one short review.
+"""
+
+import math
+import re
+from functools import lru_cache
+import numpy as np
+from model_artifact import CompiledModel, LOOKUP_CACHE_SIZE, check_supported, tfidf_weighting, word_ngrams
+
+# Batches up to this size are scored with the fused path; larger batches
+# amortize sklearn's overhead and are faster through transform/predict
+FUSED_BATCH_LIMIT = 256
+
+
+def hashing_lookup(n_features):
+    """Term -> column lookup reproducing HashingVectorizer's murmurhash3 indices"""
+    from sklearn.utils import murmurhash3_32
+
+    @lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+    def lookup(term):
+        h = murmurhash3_32(term, seed=0)
+        if h == -2147483648:
+            # Same special case as sklearn, where abs(-2**31) overflows
+            return (2147483647 - (n_features - 1)) % n_features
+        return abs(h) % n_features
+    return lookup
+
+
+class FusedScorer:
+    """Scores preprocessed reviews against a binary linear TF-IDF model"""
+
+    def __init__(self, lookup, idf, coef, intercept, classes, token_pattern,
+                 lowercase=True, ngram_range=(1, 1), binary=False, sublinear_tf=False, norm='l2'):
+        self.lookup = lookup
+        # Python lists: scalar indexing is several times faster than numpy's
+        # idf is None for featurizers without IDF weighting (hashed features)
+        self.idf = None if idf is None else [float(v) for v in idf]
+        self.coef = [float(v) for v in coef]
+        self.intercept = float(intercept)
+        self.classes = list(classes)
+        self.token_re = re.compile(token_pattern)
+        self.lowercase = lowercase
+        self.ngram_range = tuple(ngram_range)
+        self.binary = binary
+        self.sublinear_tf = sublinear_tf
+        self.norm = norm
+
+    @classmethod
+    def from_models(cls, clf, tfidf):
+        """Build a scorer from a pickled clf/tfidf pair or a CompiledModel"""
+        coef = np.asarray(clf.coef_)
+        if coef.shape[0] != 1:
+            raise ValueError("Fused scoring only supports binary classifiers")
+
+        if isinstance(tfidf, CompiledModel):
+            lookup = tfidf.column
+            use_idf, sublinear_tf, norm, idf = tfidf.use_idf, tfidf.sublinear_tf, tfidf.norm, tfidf.idf_
+        else:
+            # Pickled models are sklearn objects, so sklearn is already loaded
+            from sklearn.feature_extraction.text import HashingVectorizer
+            if isinstance(tfidf, HashingVectorizer):
+                check_supported(tfidf)
+                if tfidf.alternate_sign:
+                    raise ValueError("Fused scoring does not support alternate_sign hashing")
+                return cls(hashing_lookup(tfidf.n_features), None, coef[0], clf.intercept_[0], clf.classes_,
+                           tfidf.token_pattern, tfidf.lowercase, tfidf.ngram_range,
+                           tfidf.binary, False, tfidf.norm)
+
+            check_supported(tfidf)
+            vocabulary = tfidf.vocabulary_
+            lookup = lambda term: vocabulary.get(term, -1)
+            use_idf, sublinear_tf, norm, idf = tfidf_weighting(tfidf)
+        if not use_idf:
+            idf = np.ones(coef.shape[1])
+
+        return cls(lookup, idf, coef[0], clf.intercept_[0], clf.classes_,
+                   tfidf.token_pattern, tfidf.lowercase, tfidf.ngram_range,
+                   tfidf.binary, sublinear_tf, norm)
+
+    def decision(self, doc):
+        """Return the decision function value for one preprocessed review"""
+        lookup = self.lookup
+        counts = {}
+        for feature in word_ngrams(doc, self.token_re, self.lowercase, self.ngram_range):
+            j = lookup(feature)
+            if j >= 0:
+                counts[j] = counts.get(j, 0) + 1
+        if not counts:
+            return self.intercept
+
+        idf = self.idf
+        coef = self.coef
+        dot = 0.0
+        total = 0.0
+        for j, count in counts.items():
+            if self.binary:
+                count = 1
+            tf = 1 + math.log(count) if self.sublinear_tf else count
+            weight = tf * idf[j] if idf is not None else tf
+            dot += weight * coef[j]
+            total += weight * weight if self.norm == 'l2' else abs(weight)
+
+        if self.norm == 'l2':
+            dot /= math.sqrt(total)
+        elif self.norm == 'l1':
+            dot /= total
+        return self.intercept + dot
+
+    def predict_one(self, doc):
+        """Predict the label of one preprocessed review"""
+        return self.classes[1] if self.decision(doc) > 0 else self.classes[0]
+
+    def predict_proba_one(self, doc):
+        """Return the positive-class probability of one preprocessed review"""
+        return 1 / (1 + math.exp(-self.decision(doc)))
+
+    def score(self, doc):
+        """Return (label, positive-class probability) for one preprocessed review"""
+        decision = self.decision(doc)
+        label = self.classes[1] if decision > 0 else self.classes[0]
+        return label, 1 / (1 + math.exp(-decision))
+
+    def predict(self, docs):
+        """Predict labels for a batch of preprocessed reviews"""
+        return np.array([self.predict_one(doc) for doc in docs])
+
+    def predict_proba(self, docs):
+        """Return [P(negative), P(positive)] rows for a batch of preprocessed reviews"""
+        positive = np.array([self.predict_proba_one(doc) for doc in docs])
+        return np.column_stack([1 - positive, positive])
+
+
+def check_equivalence(scorer, clf, tfidf, docs, tolerance=1e-9):
+    """
+    Compare a fused scorer or a CompiledModel with the sklearn transform/predict path
+
+    Returns (mismatched_predictions, max_decision_difference). Raises
+    ValueError if any prediction differs or the decision values drift by
+    more than tolerance.
+    """
+    docs = list(docs)
+    if not docs:
+        return 0, 0.0
+    X = tfidf.transform(docs)
+    expected = np.ravel(clf.decision_function(X))
+    if isinstance(scorer, CompiledModel):
+        compiled_X = scorer.transform(docs)
+        actual = np.ravel(scorer.decision_function(compiled_X))
+        predictions = scorer.predict(compiled_X)
+    else:
+        actual = np.array([scorer.decision(doc) for doc in docs])
+        predictions = scorer.predict(docs)
+    max_difference = float(np.max(np.abs(expected - actual)))
+    mismatched = int(np.sum(clf.predict(X) != predictions))
+    if mismatched or max_difference > tolerance:
+        raise ValueError(f"{type(scorer).__name__} disagrees with sklearn: {mismatched} predictions differ, "
+                         f"max decision difference {max_difference:.3g}")
+    return mismatched, max_difference
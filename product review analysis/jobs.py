@@ -0,0 +1,298 @@
+"""
+Background jobs for large CSV uploads
+An upload is spooled to disk and recorded in a small SQLite table, and a job
+ID is returned straight away. A bounded process pool runs the analysis and
+writes progress and final counts back to the table, where clients poll for
+them. Jobs run in separate processes so that long analyses don't hold the
+web process's GIL while it serves interactive requests.
+
+Running jobs check for cancellation between CSV chunks. Finished jobs are
+kept for JOB_RETENTION seconds, and spooled uploads are deleted as soon as
+their job ends.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from parallel import process_context
+
+logger = logging.getLogger(__name__)
+
+# Jobs analysed at the same time by one web process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Queued plus running jobs accepted before new uploads are refused
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 100))
+# Seconds a finished job's result is kept
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 24 * 3600))
+# A relative path is resolved against the app directory, like MODEL_DIR
+JOB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ.get('JOB_DIR', 'cache/jobs'))
+JOB_DB_PATH = os.path.join(JOB_DIR, 'jobs.sqlite3')
+
+
+class JobCancelled(Exception):
+    """Raised from a progress callback to stop a cancelled job"""
+
+
+class QueueFull(Exception):
+    """Raised when JOB_MAX_PENDING jobs are already waiting or running"""
+
+
+class JobStore:
+    """SQLite job table shared by the web process and the job workers"""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+
+    @contextmanager
+    def _connect(self):
+        # Short-lived connections: the table is shared across processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def init(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    spool_path TEXT,
+                    owner_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    rows_processed INTEGER NOT NULL DEFAULT 0,
+                    progress REAL NOT NULL DEFAULT 0,
+                    positive INTEGER,
+                    negative INTEGER,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+    def create(self, job_id, filename, spool_path):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, status, filename, spool_path, owner_pid, created_at) "
+                         "VALUES (?, 'queued', ?, ?, ?, ?)",
+                         (job_id, filename, spool_path, os.getpid(), time.time()))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def count_active(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def start(self, job_id):
+        """Mark a queued job as running; False if it was cancelled first"""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'running', started_at = ? "
+                                  "WHERE id = ? AND status = 'queued' AND cancel_requested = 0",
+                                  (time.time(), job_id))
+            return cursor.rowcount == 1
+
+    def progress(self, job_id, rows_processed, progress):
+        """Record progress; returns True if cancellation was requested"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET rows_processed = ?, progress = ? WHERE id = ?",
+                         (rows_processed, progress, job_id))
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id, status, positive=None, negative=None, error=None):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ?, positive = ?, negative = ?, error = ?, "
+                         "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END WHERE id = ?",
+                         (status, time.time(), positive, negative, error, status, job_id))
+
+    def request_cancel(self, job_id):
+        """Flag a job for cancellation; queued jobs are cancelled immediately"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')",
+                         (job_id,))
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                         (time.time(), job_id))
+
+    def fail_orphans(self):
+        """Fail active jobs whose owning web process is gone (e.g. after a restart)"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, owner_pid, spool_path FROM jobs "
+                                "WHERE status IN ('queued', 'running')").fetchall()
+        for row in rows:
+            if not _pid_alive(row['owner_pid']):
+                self.finish(row['id'], 'failed', error='Interrupted by a server restart')
+                _remove(row['spool_path'])
+
+    def purge(self, retention=JOB_RETENTION):
+        """Delete finished jobs older than the retention period"""
+        cutoff = time.time() - retention
+        with self._connect() as conn:
+            rows = conn.execute("SELECT spool_path FROM jobs WHERE status IN ('done', 'failed', 'cancelled') "
+                                "AND finished_at < ?", (cutoff,)).fetchall()
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+                         (cutoff,))
+        for row in rows:
+            _remove(row['spool_path'])
+        return len(rows)
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove(path):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def run_job(db_path, job_id, spool_path, analyze):
+    """
+    Worker entry point: analyse one spooled CSV and record the outcome
+
+    analyze(csv_file, on_chunk=callback) must return (positive, negative) and
+    call callback(rows_processed, positive, negative) after every chunk.
+    """
+    store = JobStore(db_path)
+    if not store.start(job_id):
+        _remove(spool_path)
+        return
+    try:
+        size = max(os.path.getsize(spool_path), 1)
+        with open(spool_path, 'rb') as f:
+            def on_chunk(rows_processed, positive, negative):
+                if store.progress(job_id, rows_processed, min(f.tell() / size, 0.99)):
+                    raise JobCancelled()
+            positive, negative = analyze(f, on_chunk=on_chunk)
+        store.finish(job_id, 'done', positive, negative)
+    except JobCancelled:
+        store.finish(job_id, 'cancelled')
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        store.finish(job_id, 'failed', error=str(e))
+    finally:
+        _remove(spool_path)
+
+
+class JobQueue:
+    """Accepts uploads and runs them on a lazily created process pool"""
+
+    def __init__(self, analyze, workers=JOB_WORKERS, directory=JOB_DIR, max_pending=JOB_MAX_PENDING):
+        self.analyze = analyze
+        self.workers = workers
+        self.directory = directory
+        self.max_pending = max_pending
+        self.store = JobStore(os.path.join(directory, 'jobs.sqlite3'))
+        self._pool = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _ensure_ready(self):
+        # Created on first use so that nothing is forked or opened at import
+        with self._lock:
+            if not self._initialized:
+                os.makedirs(os.path.join(self.directory, 'uploads'), exist_ok=True)
+                self.store.init()
+                self.store.fail_orphans()
+                self._initialized = True
+            if self._pool is None:
+                # Job workers never start a batch pool of their own (see parallel.init_pool)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context())
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a pool broken by a dead worker so the next job gets a new one"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, uploaded_file):
+        """Spool an uploaded file (werkzeug FileStorage) and queue it; returns the job ID"""
+        pool = self._ensure_ready()
+        self.store.purge()
+        if self.store.count_active() >= self.max_pending:
+            raise QueueFull(f"{self.max_pending} jobs are already queued or running")
+
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(self.directory, 'uploads', f'{job_id}.csv')
+        uploaded_file.save(spool_path)
+        self.store.create(job_id, uploaded_file.filename, spool_path)
+        try:
+            future = pool.submit(run_job, self.store.path, job_id, spool_path, self.analyze)
+        except BrokenProcessPool:
+            # A worker died since the last job; its jobs are failed by _done
+            self._discard_pool(pool)
+            pool = self._ensure_ready()
+            future = pool.submit(run_job, self.store.path, job_id, spool_path, self.analyze)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._done(job_id, spool_path, pool, f))
+        logger.info("Queued job %s (%s)", job_id, uploaded_file.filename)
+        return job_id
+
+    def _done(self, job_id, spool_path, pool, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled() or not isinstance(future.exception(), BrokenProcessPool):
+            return
+        # A job worker died (e.g. killed for running out of memory): every job
+        # still on its pool fails, and the pool is replaced on the next upload
+        logger.error("Job %s lost: a job worker exited unexpectedly", job_id)
+        job = self.store.get(job_id)
+        if job and job['status'] in ('queued', 'running'):
+            self.store.finish(job_id, 'failed', error='The job worker exited unexpectedly')
+        _remove(spool_path)
+        self._discard_pool(pool)
+
+    def status(self, job_id):
+        """Return the job's record as a dict, or None if unknown or expired"""
+        self._ensure_ready()
+        return self.store.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the updated record"""
+        self._ensure_ready()
+        self.store.request_cancel(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            # Never started: the worker won't clean up the upload
+            job = self.store.get(job_id)
+            if job:
+                _remove(job['spool_path'])
+        return self.store.get(job_id)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,152 @@
+"""
+Prometheus metrics for the app
+A small in-process registry of labelled counters and histograms, rendered in
+the Prometheus text exposition format by the /metrics route. Values are kept
+per process, so each worker of a prefork server is scraped separately.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds; fine at the low end for per-review model stages,
+# up to a minute for full CSV uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = sorted(self._values.items())
+            lines.extend(self._samples(values))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. scraped reviews"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self, values):
+        for key, value in values:
+            yield f'{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies in seconds) in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Bucket i counts values <= buckets[i]; the last slot is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def _samples(self, values):
+        for key, (counts, total) in values:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(pairs + [("le", _format_value(bound))])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(pairs)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(pairs)} {cumulative}'
+
+
+def render():
+    """Return every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Shared by the backend, the model code paths and the scrapers
+stage_seconds = Histogram(
+    'review_stage_seconds', 'Time spent in each model pipeline stage', ['stage'])
+scrape_stage_seconds = Histogram(
+    'review_scrape_stage_seconds', 'Time spent fetching, parsing and matching scraped pages', ['stage', 'site'])
+scraped_reviews = Counter(
+    'review_scraped_reviews_total', 'Reviews returned by the scrapers', ['site'])
+selector_hits = Counter(
+    'review_scrape_selector_hits_total', 'Elements matched by each scraper selector', ['site', 'selector'])
+scrape_failures = Counter(
+    'review_scrape_failures_total', 'Scraped pages that could not be used', ['site', 'reason'])
+duplicate_reviews = Counter(
+    'review_duplicates_total', 'Reviews dropped as exact or near duplicates', ['source', 'kind'])
+http_request_seconds = Histogram(
+    'review_http_request_seconds', 'HTTP request latency by endpoint', ['endpoint', 'method', 'status'])
+model_registry_events = Counter(
+    'review_model_registry_events_total', 'Model sets loaded, swapped in or evicted, by category', ['category', 'event'])
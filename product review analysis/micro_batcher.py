@@ -0,0 +1,85 @@
+"""
+Request micro-batching for the JSON prediction API
+Concurrent small requests are queued and flushed together as one model
+call once max_batch_size reviews are waiting or the oldest request has
+waited max_wait seconds, whichever comes first.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 256))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', 5))
+
+
+class MicroBatcher:
+    """Combines concurrent predict calls into single batched calls"""
+
+    def __init__(self, predict_fn, max_batch_size=MICRO_BATCH_MAX_SIZE,
+                 max_wait=MICRO_BATCH_MAX_WAIT_MS / 1000):
+        """
+        predict_fn takes a list of items and returns a list of results of
+        the same length, in the same order.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = {'requests': 0, 'items': 0, 'batches': 0}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started lazily so that no thread exists before a prefork server forks
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, items):
+        """Queue items for prediction and return a Future for their results"""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((list(items), future))
+        return future
+
+    def predict(self, items, timeout=None):
+        """Predict items through the batcher and wait for the results"""
+        return self.submit(items).result(timeout)
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                size += len(request[0])
+            self._flush(pending)
+
+    def _flush(self, pending):
+        items = [item for request_items, _ in pending for item in request_items]
+        self.stats['requests'] += len(pending)
+        self.stats['items'] += len(items)
+        self.stats['batches'] += 1
+        try:
+            results = self.predict_fn(items)
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for request_items, future in pending:
+            future.set_result(results[offset:offset + len(request_items)])
+            offset += len(request_items)
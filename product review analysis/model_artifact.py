@@ -0,0 +1,438 @@
+"""
+Compiled, memory-mappable model artifact
+The upgrade scripts export the fitted TF-IDF vectorizer and linear classifier
+into one flat binary file: the vocabulary (as a string blob plus an
+open-addressing hash table), the IDF vector, the n-gram/tokenizer config,
+the coefficients, the intercept and a format version. The backend maps the
+file read-only, so every worker process on a host shares the same pages
+instead of unpickling a private copy of the vocabulary dict and arrays.
+
+File layout:
+    MAGIC (8 bytes) | format version (uint32) | header length (uint32)
+    | JSON header | sections, each aligned to 8 bytes
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+import time
+import zlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MAGIC = b'PRAMODEL'
+ARTIFACT_PATH = 'models/model.bin'
+# Written last by save_models(): the name, size and mtime of every file in
+# the set, so readers can tell a complete set from one being replaced
+MANIFEST_NAME = 'manifest.json'
+# Tries at loading a model set that keeps changing underneath the loader
+LOAD_ATTEMPTS = 5
+
+# Recently looked-up terms kept in a small per-process dict; the full
+# vocabulary stays in the shared mapping
+LOOKUP_CACHE_SIZE = 100000
+
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGN = 8
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def word_ngrams(doc, token_re, lowercase=True, ngram_range=(1, 1)):
+    """Split a document into word n-grams the same way TfidfVectorizer's word analyzer does"""
+    if lowercase:
+        doc = doc.lower()
+    tokens = token_re.findall(doc)
+    min_n, max_n = ngram_range
+    if max_n == 1:
+        return tokens
+
+    original_tokens = tokens
+    if min_n == 1:
+        tokens = list(original_tokens)
+        min_n += 1
+    else:
+        tokens = []
+    n_original_tokens = len(original_tokens)
+    for n in range(min_n, min(max_n + 1, n_original_tokens + 1)):
+        for i in range(n_original_tokens - n + 1):
+            tokens.append(" ".join(original_tokens[i:i + n]))
+    return tokens
+
+
+def check_supported(tfidf):
+    """Raise ValueError if the vectorizer uses options the artifact cannot reproduce"""
+    unsupported = []
+    if tfidf.analyzer != 'word':
+        unsupported.append(f"analyzer={tfidf.analyzer!r}")
+    for option in ('tokenizer', 'preprocessor', 'strip_accents', 'stop_words'):
+        if getattr(tfidf, option) is not None:
+            unsupported.append(f"{option}={getattr(tfidf, option)!r}")
+    if tfidf.input != 'content':
+        unsupported.append(f"input={tfidf.input!r}")
+    if unsupported:
+        raise ValueError("Cannot compile vectorizer with " + ", ".join(unsupported))
+
+
+def tfidf_weighting(tfidf):
+    """
+    Return (use_idf, sublinear_tf, norm, idf) as tfidf.transform applies them
+
+    Vectorizers pickled by old scikit-learn versions keep these settings
+    only on their internal TfidfTransformer, and have no idf_: current
+    scikit-learn then transforms them without IDF weighting, so use_idf is
+    False for them whatever they were fitted with.
+    """
+    inner = getattr(tfidf, '_tfidf', None)
+
+    def setting(name):
+        return getattr(tfidf, name) if hasattr(tfidf, name) else getattr(inner, name)
+
+    idf = tfidf.idf_ if setting('use_idf') and hasattr(tfidf, 'idf_') else None
+    return idf is not None, setting('sublinear_tf'), setting('norm'), idf
+
+
+def _build_slots(terms):
+    """Open-addressing table mapping crc32(term) to the term's column index"""
+    size = 1
+    while size < 2 * max(len(terms), 1):
+        size *= 2
+    mask = size - 1
+    slots = np.full(size, -1, dtype=np.int32)
+    for column, term in enumerate(terms):
+        h = zlib.crc32(term) & mask
+        while slots[h] != -1:
+            h = (h + 1) & mask
+        slots[h] = column
+    return slots
+
+
+def export_artifact(clf, tfidf, path=ARTIFACT_PATH):
+    """Write clf and tfidf as a compiled artifact at path"""
+    check_supported(tfidf)
+    use_idf, sublinear_tf, norm, idf = tfidf_weighting(tfidf)
+
+    vocabulary = tfidf.vocabulary_
+    terms = [term.encode('utf-8') for term in sorted(vocabulary, key=vocabulary.get)]
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(term) for term in terms])
+    coef = np.ascontiguousarray(clf.coef_, dtype=np.float64)
+
+    sections = [
+        ('idf', np.ascontiguousarray(idf if use_idf else np.ones(len(terms)), dtype=np.float64)),
+        ('coef', coef.ravel()),
+        ('intercept', np.ascontiguousarray(clf.intercept_, dtype=np.float64)),
+        ('term_offsets', offsets),
+        ('term_slots', _build_slots(terms)),
+        ('term_blob', np.frombuffer(b''.join(terms), dtype=np.uint8)),
+    ]
+
+    header = {
+        'n_features': len(terms),
+        'lowercase': bool(tfidf.lowercase),
+        'token_pattern': tfidf.token_pattern,
+        'ngram_range': list(tfidf.ngram_range),
+        'binary': bool(tfidf.binary),
+        'sublinear_tf': bool(sublinear_tf),
+        'use_idf': bool(use_idf),
+        'norm': norm,
+        'classes': clf.classes_.tolist(),
+        'coef_shape': list(coef.shape),
+        'sections': {},
+    }
+
+    # Section offsets depend on the header length, which depends on the
+    # offsets; lay out against a padded header until it stops growing
+    header_len = 0
+    while True:
+        position = _align(_PREAMBLE.size + header_len)
+        for name, array in sections:
+            header['sections'][name] = [position, array.dtype.str, int(array.size)]
+            position = _align(position + array.nbytes)
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) <= header_len:
+            break
+        header_len = len(encoded) + 64
+    encoded = encoded.ljust(header_len)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, header_len))
+        f.write(encoded)
+        for name, array in sections:
+            f.seek(header['sections'][name][0])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def save_models(clf, tfidf, clf_path, tfidf_path, artifact_path=None):
+    """
+    Write a model set over the served one
+
+    Every file is written next to its destination and moved into place, so
+    the app never loads a partly written file. The compiled artifact is
+    exported too when artifact_path is given. The manifest listing the new
+    files goes in last; until it does, readers see the files don't match
+    the old manifest and wait instead of mixing old and new files. Returns
+    the paths written.
+    """
+    written = []
+    for obj, path in ((clf, clf_path), (tfidf, tfidf_path)):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f)
+        os.replace(tmp_path, path)
+        written.append(path)
+    if artifact_path is not None:
+        written.append(export_artifact(clf, tfidf, artifact_path))
+
+    manifest_path = _manifest_path(written)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({os.path.basename(path): _file_state(path) for path in written}, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return written
+
+
+class CompiledModel:
+    """
+    Read-only TF-IDF + linear model backed by a memory-mapped artifact
+
+    Implements the subset of the TfidfVectorizer and LogisticRegression APIs
+    the app uses: transform(), decision_function(), predict() and
+    predict_proba().
+    """
+
+    def __init__(self, path=ARTIFACT_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled model artifact")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+        header = json.loads(bytes(self._mm[_PREAMBLE.size:_PREAMBLE.size + header_len]))
+
+        self.version = version
+        self.n_features = header['n_features']
+        self.lowercase = header['lowercase']
+        self.token_pattern = header['token_pattern']
+        self.ngram_range = tuple(header['ngram_range'])
+        self.binary = header['binary']
+        self.sublinear_tf = header['sublinear_tf']
+        self.use_idf = header['use_idf']
+        self.norm = header['norm']
+        self.classes_ = np.array(header['classes'])
+
+        view = memoryview(self._mm)
+        arrays = {}
+        views = {}
+        for name, (offset, dtype, count) in header['sections'].items():
+            dtype = np.dtype(dtype)
+            arrays[name] = np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset)
+            views[name] = view[offset:offset + dtype.itemsize * count]
+        self.idf_ = arrays['idf']
+        self.coef_ = arrays['coef'].reshape(header['coef_shape'])
+        self.intercept_ = arrays['intercept']
+
+        # Plain memoryviews index faster than numpy scalars in the lookup loop
+        self._offsets = views['term_offsets'].cast('q')
+        self._slots = views['term_slots'].cast('i')
+        self._blob = views['term_blob']
+        self._mask = len(self._slots) - 1
+
+        self._token_re = re.compile(self.token_pattern)
+        self._lookup_cache = {}
+
+    def column(self, term):
+        """Return the feature column for a term, or -1 if it is not in the vocabulary"""
+        cache = self._lookup_cache
+        column = cache.get(term)
+        if column is None:
+            if len(cache) >= LOOKUP_CACHE_SIZE:
+                cache.clear()
+            column = cache[term] = self._probe(term)
+        return column
+
+    def _probe(self, term):
+        encoded = term.encode('utf-8')
+        slots = self._slots
+        offsets = self._offsets
+        h = zlib.crc32(encoded) & self._mask
+        while True:
+            column = slots[h]
+            if column < 0:
+                return -1
+            if self._blob[offsets[column]:offsets[column + 1]] == encoded:
+                return column
+            h = (h + 1) & self._mask
+
+    def analyze(self, doc):
+        """Split a document into word n-grams exactly like TfidfVectorizer"""
+        return word_ngrams(doc, self._token_re, self.lowercase, self.ngram_range)
+
+    def transform(self, raw_documents):
+        """Return the TF-IDF matrix (scipy CSR) for an iterable of documents"""
+        from scipy.sparse import csr_matrix
+
+        indptr = [0]
+        indices = []
+        values = []
+        column = self.column
+        for doc in raw_documents:
+            counts = {}
+            for feature in self.analyze(doc):
+                j = column(feature)
+                if j >= 0:
+                    counts[j] = counts.get(j, 0) + 1
+            for j in sorted(counts):
+                indices.append(j)
+                values.append(counts[j])
+            indptr.append(len(indices))
+
+        n_docs = len(indptr) - 1
+        data = np.asarray(values, dtype=np.float64)
+        indices = np.asarray(indices, dtype=np.int32)
+        indptr = np.asarray(indptr, dtype=np.int64)
+
+        if self.binary:
+            data.fill(1)
+        if self.sublinear_tf:
+            np.log(data, data)
+            data += 1
+        if self.use_idf:
+            data *= self.idf_[indices]
+        if self.norm:
+            rows = np.repeat(np.arange(n_docs), np.diff(indptr))
+            weights = data * data if self.norm == 'l2' else np.abs(data)
+            norms = np.bincount(rows, weights=weights, minlength=n_docs)
+            if self.norm == 'l2':
+                norms = np.sqrt(norms)
+            norms[norms == 0] = 1
+            data /= norms[rows]
+
+        return csr_matrix((data, indices, indptr), shape=(n_docs, self.n_features))
+
+    def decision_function(self, X):
+        scores = np.asarray(X @ self.coef_.T) + self.intercept_
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+    def predict_proba(self, X):
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            positive = 1 / (1 + np.exp(-scores))
+            return np.column_stack([1 - positive, positive])
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+
+def _manifest_path(paths):
+    return os.path.join(os.path.dirname(paths[0]), MANIFEST_NAME)
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def read_manifest(paths):
+    """{file name: [size, mtime_ns]} of the set last saved next to paths, or None without a manifest"""
+    try:
+        with open(_manifest_path(paths)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def model_version(paths):
+    """
+    Return a short identifier for the current contents of the model files
+
+    Derived from each file's size and modification time, so it changes
+    whenever the upgrade scripts rewrite a model without reading the files.
+    With a manifest only the files it lists count, and the version is None
+    while they don't match it, i.e. while a new set is being written.
+    """
+    manifest = read_manifest(paths)
+    if manifest is not None:
+        paths = [path for path in paths if os.path.basename(path) in manifest]
+        for path in paths:
+            try:
+                if _file_state(path) != manifest[os.path.basename(path)]:
+                    return None
+            except FileNotFoundError:
+                return None
+    digest = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        digest.update(f'{path}:{st.st_size}:{st.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_models(clf_path, tfidf_path, artifact_path=ARTIFACT_PATH):
+    """
+    Return (clf, tfidf) for serving
+
+    Uses the memory-mapped artifact when it exists, belongs to the saved set
+    and is at least as new as the pickles (both values are then the same
+    CompiledModel); otherwise falls back to unpickling.
+    """
+    manifest = read_manifest((clf_path, tfidf_path, artifact_path))
+    if manifest is not None and os.path.basename(artifact_path) not in manifest:
+        logger.debug("Ignoring %s: not part of the saved model set", artifact_path)
+    elif os.path.exists(artifact_path):
+        pickle_times = [os.path.getmtime(p) for p in (clf_path, tfidf_path) if os.path.exists(p)]
+        if os.path.getmtime(artifact_path) >= max(pickle_times, default=0):
+            try:
+                model = CompiledModel(artifact_path)
+                return model, model
+            except ValueError as e:
+                logger.warning("Ignoring model artifact: %s", e)
+        else:
+            logger.warning("Ignoring %s: older than the pickled models", artifact_path)
+
+    with open(clf_path, 'rb') as f:
+        clf = pickle.load(f)
+    with open(tfidf_path, 'rb') as f:
+        tfidf = pickle.load(f)
+    return clf, tfidf
+
+
+def load_model_set(paths):
+    """
+    Return (clf, tfidf, version) for the (clf, tfidf, artifact) paths
+
+    The version is taken before and after loading and must match, so it
+    describes the files actually loaded. A set that is being replaced is
+    waited for, up to LOAD_ATTEMPTS tries a second apart.
+    """
+    for attempt in range(LOAD_ATTEMPTS):
+        if attempt:
+            time.sleep(1)
+        version = model_version(paths)
+        if version is None:
+            continue
+        clf, tfidf = load_models(*paths)
+        if model_version(paths) == version:
+            return clf, tfidf, version
+    raise ValueError(f"Model files in {os.path.dirname(paths[0])} kept changing while loading")
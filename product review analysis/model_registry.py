@@ -0,0 +1,190 @@
+"""
+Per-category model registry
+Specialized models live next to the default one, one directory per
+category under MODEL_DIR, with the same files (clf.pkl, tfidf.pkl,
+model.bin):
+
+    models/                 default model, used when nothing more specific exists
+    models/amazon.in/       reviews scraped from amazon.in
+    models/electronics/     reviews sent with "category": "electronics"
+
+Each model set is loaded on first use and kept in a least recently used
+cache bounded by MODEL_CACHE_MAX_BYTES; the default set is never evicted.
+Every loaded set is checked for new files at most every check interval and
+swapped in as a whole once its files have settled. Requests that already
+hold the old set finish on it, and nothing needs a restart.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from model_artifact import model_version
+from metrics import model_registry_events
+
+logger = logging.getLogger(__name__)
+
+# Where the app serves models from and the upgrade scripts write them. A
+# relative path is resolved against the app directory, so the app and the
+# scripts agree whatever directory they are started from
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ.get('MODEL_DIR', 'models'))
+
+# Approximate memory for loaded model sets (the size of the files they
+# were loaded from) before least recently used ones are dropped
+MODEL_CACHE_MAX_BYTES = int(os.environ.get('MODEL_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+MODEL_FILES = ('clf.pkl', 'tfidf.pkl', 'model.bin')
+
+# Category names whose directory lookup is remembered; clients choose the
+# names, so the memo is reset rather than allowed to grow without bound
+KNOWN_CATEGORIES_MAX = 10000
+
+# Category names double as directory names, so nothing path-like is accepted
+category_pattern = re.compile(r'^[a-z0-9][a-z0-9._-]*$')
+
+
+def model_paths(directory):
+    """(clf, tfidf, artifact) paths of the model set in a directory"""
+    return tuple(os.path.join(directory, name) for name in MODEL_FILES)
+
+
+def category_for_url(url):
+    """Model category for a scraped product URL: its host, e.g. amazon.in"""
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class _Slot:
+    """One category's current models and its change-check state"""
+
+    def __init__(self, models):
+        self.models = models
+        self.checked_at = time.monotonic()
+        self.seen = models['version']
+        self.check_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, memory-bounded, hot-swapped model sets keyed by category
+
+    load(paths) must return a dict with at least 'version' (model_version()
+    of the files it loaded) and 'bytes'. on_swap(category, models), if given, is
+    called after a new version replaced an old one.
+    """
+
+    def __init__(self, model_dir, load, check_interval, max_bytes=MODEL_CACHE_MAX_BYTES, on_swap=None):
+        self.model_dir = model_dir
+        self.load = load
+        self.check_interval = check_interval
+        self.max_bytes = max_bytes
+        self.on_swap = on_swap
+        # Category (None for the default) -> _Slot, least recently used first
+        self._slots = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # Category -> (checked_at, has its own models), so unknown
+        # categories don't cost a stat call on every request
+        self._known = {}
+
+    def directory(self, category):
+        return self.model_dir if category is None else os.path.join(self.model_dir, category)
+
+    def resolve(self, category):
+        """The category whose models serve a request for category: itself, or None for the default"""
+        if not category:
+            return None
+        category = category.lower()
+        if not category_pattern.match(category):
+            return None
+        now = time.monotonic()
+        known = self._known.get(category)
+        if known is None or now - known[0] >= self.check_interval:
+            paths = model_paths(self.directory(category))
+            known = (now, os.path.exists(paths[0]) or os.path.exists(paths[2]))
+            if len(self._known) >= KNOWN_CATEGORIES_MAX:
+                self._known.clear()
+            self._known[category] = known
+        return category if known[1] else None
+
+    def get(self, category=None):
+        """Return the current models for a category, loading or swapping them in as needed"""
+        category = self.resolve(category)
+        with self._lock:
+            slot = self._slots.get(category)
+            if slot is not None:
+                self._slots.move_to_end(category)
+        if slot is None:
+            return self._load(category)
+        self._check(category, slot)
+        return slot.models
+
+    def _load(self, category):
+        with self._load_lock:
+            with self._lock:
+                slot = self._slots.get(category)
+            if slot is not None:
+                return slot.models
+            models = self.load(model_paths(self.directory(category)))
+            with self._lock:
+                self._slots[category] = _Slot(models)
+                self._evict()
+        model_registry_events.inc(category=category or 'default', event='load')
+        logger.info("Loaded %s models (version %s)", category or 'default', models['version'])
+        return models
+
+    def _evict(self):
+        total = sum(slot.models['bytes'] for slot in self._slots.values())
+        # The most recently used set (just loaded) and the default always stay
+        for category in list(self._slots)[:-1]:
+            if total <= self.max_bytes:
+                break
+            if category is not None:
+                total -= self._slots.pop(category).models['bytes']
+                model_registry_events.inc(category=category, event='evict')
+                logger.info("Evicted %s models", category)
+
+    def _check(self, category, slot):
+        """
+        Swap in new model files for a loaded category
+
+        The files are checked at most every check interval, and a new
+        version is only loaded once it has been unchanged for one interval,
+        so a swap never picks up a half-written set of files. Sets saved
+        with a manifest have no version until every file matches it.
+        """
+        now = time.monotonic()
+        if now - slot.checked_at < self.check_interval or not slot.check_lock.acquire(blocking=False):
+            return
+        try:
+            slot.checked_at = now
+            version = model_version(model_paths(self.directory(category)))
+            if version is None:
+                return
+            settled = version == slot.seen
+            slot.seen = version
+            if version == slot.models['version'] or not settled:
+                return
+            try:
+                models = self.load(model_paths(self.directory(category)))
+            except Exception:
+                logger.exception("Reloading %s models failed, keeping the current ones", category or 'default')
+                return
+            # In-flight requests keep their reference to the old set
+            slot.models = models
+            with self._lock:
+                self._evict()
+            model_registry_events.inc(category=category or 'default', event='swap')
+            logger.info("Swapped in %s models (version %s)", category or 'default', models['version'])
+            if self.on_swap is not None:
+                self.on_swap(category, models)
+        finally:
+            slot.check_lock.release()
+
+    def loaded(self):
+        """Return {category: version} for the model sets in memory, default as None"""
+        with self._lock:
+            return {category: slot.models['version'] for category, slot in self._slots.items()}
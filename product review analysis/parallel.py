@@ -0,0 +1,185 @@
+"""
+Process-pool parallelism for large review batches
+The pool is opt-in (PARALLEL_WORKERS > 0), started by the first batch that
+needs it and reused for the lifetime of the process. Batches smaller than
+PARALLEL_THRESHOLD always run in-process, so short requests never pay the
+IPC cost.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from text_preprocessing import preprocess_batch
+from model_artifact import load_model_set
+from metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', 0))
+PARALLEL_THRESHOLD = int(os.environ.get('PARALLEL_THRESHOLD', 20000))
+
+# Shards per worker; a few per worker keeps the pool busy when
+# some shards contain longer reviews than others
+SHARDS_PER_WORKER = 4
+
+_pool = None
+# Workers of the shared pool once init_pool() enabled it; the pool itself
+# is started by the first batch large enough to use it
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+# Model sets kept loaded inside one worker process (one per category in use)
+WORKER_MODEL_SETS = 4
+
+# Models loaded inside a worker process, keyed by model paths and version,
+# least recently used first
+_worker_models = OrderedDict()
+
+
+class ModelChanged(Exception):
+    """Raised in a worker whose model files moved on from the version it was asked for"""
+
+
+def process_context():
+    """
+    Start method for worker processes
+
+    Pools are created, and their workers started, while the web process
+    runs other threads (request threads, the micro-batcher, scrape fetches).
+    A forked child could inherit a lock one of them held, e.g. in logging or
+    the metrics registry, and deadlock on it, so workers are started from a
+    clean single-threaded forkserver process instead (spawn where forkserver
+    is unavailable).
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def init_pool(workers=PARALLEL_WORKERS):
+    """Enable the shared process pool (no-op if disabled or already enabled)"""
+    global _pool_size
+    if not _pool_size and workers > 0:
+        _pool_size = workers
+
+
+def _get_pool():
+    """Return the shared pool, starting it on first use; None where batches run in-process"""
+    global _pool
+    # Worker processes (pool and job workers) import the app too, e.g. as
+    # the __main__ module of python backend.py, and always score in-process
+    if _pool is None and _pool_size and multiprocessing.parent_process() is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=_pool_size, mp_context=process_context())
+                # Releases the pool's semaphores, which the resource tracker
+                # otherwise reports as leaked at exit
+                atexit.register(shutdown_pool)
+    return _pool
+
+
+def shutdown_pool():
+    """Shut down the shared process pool"""
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    _pool_size = 0
+
+
+def forget_pool():
+    """Drop a pool reference inherited through fork without touching the pool"""
+    global _pool, _pool_size
+    _pool = None
+    _pool_size = 0
+
+
+def _use_pool(n_items, threshold):
+    return n_items > 0 and n_items >= threshold and _get_pool() is not None
+
+
+def _shards(items, n_shards):
+    """Split a list into at most n_shards contiguous, order-preserving slices"""
+    size = -(-len(items) // n_shards)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _load_worker_models(model_paths, version):
+    # Keyed by version too, so workers pick up models reloaded by the parent
+    key = (model_paths, version)
+    if key in _worker_models:
+        _worker_models.move_to_end(key)
+        return _worker_models[key]
+    # An older version of the same models is never needed again
+    for stale in [k for k in _worker_models if k[0] == model_paths]:
+        del _worker_models[stale]
+    while len(_worker_models) >= WORKER_MODEL_SETS:
+        _worker_models.popitem(last=False)
+    try:
+        clf, tfidf, loaded_version = load_model_set(model_paths)
+    except ValueError as e:
+        # Files being replaced right now; the parent still has its set
+        raise ModelChanged(str(e))
+    if version is not None and loaded_version != version:
+        # The files were replaced after the parent loaded its set
+        raise ModelChanged(f"Expected model version {version}, found {loaded_version}")
+    _worker_models[key] = clf, tfidf
+    return _worker_models[key]
+
+
+def _score(clf, tfidf, texts):
+    """Return (labels, positive probabilities) for raw texts"""
+    with stage_seconds.time(stage='preprocess'):
+        processed = preprocess_batch(texts)
+    with stage_seconds.time(stage='vectorize'):
+        X = tfidf.transform(processed)
+    with stage_seconds.time(stage='predict'):
+        return clf.predict(X), clf.predict_proba(X)[:, 1]
+
+
+def _score_shard(model_paths, version, texts):
+    """Worker task: preprocess, vectorize and score one shard"""
+    clf, tfidf = _load_worker_models(model_paths, version)
+    return _score(clf, tfidf, texts)
+
+
+def preprocess_parallel(texts, threshold=PARALLEL_THRESHOLD):
+    """Preprocess texts, sharding across the pool for large batches"""
+    texts = list(texts)
+    if not _use_pool(len(texts), threshold):
+        return preprocess_batch(texts)
+
+    processed = []
+    for part in _pool.map(preprocess_batch, _shards(texts, _pool_size * SHARDS_PER_WORKER)):
+        processed.extend(part)
+    return processed
+
+
+def score_parallel(texts, clf, tfidf, model_paths, version=None, threshold=PARALLEL_THRESHOLD):
+    """
+    Preprocess, vectorize and score texts; returns (labels, positive probabilities)
+
+    Small batches use the in-process clf/tfidf. Large batches are sharded
+    across the pool, where each worker loads the same model files once per
+    model version (model_paths is passed to model_artifact.load_model_set).
+    If the files no longer hold that version, the batch is scored in-process.
+    """
+    texts = list(texts)
+    if not _use_pool(len(texts), threshold):
+        return _score(clf, tfidf, texts)
+
+    task = partial(_score_shard, model_paths, version)
+    # Stage timings inside the workers stay in the workers; time the whole call
+    try:
+        with stage_seconds.time(stage='pool_score'):
+            parts = list(_pool.map(task, _shards(texts, _pool_size * SHARDS_PER_WORKER)))
+    except ModelChanged as e:
+        logger.info("Scoring in-process: %s", e)
+        return _score(clf, tfidf, texts)
+    return (np.concatenate([labels for labels, _ in parts]),
+            np.concatenate([probabilities for _, probabilities in parts]))
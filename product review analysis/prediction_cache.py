@@ -0,0 +1,100 @@
+"""
+In-memory prediction cache for repeated reviews
+Scraped and uploaded reviews repeat heavily ("Good product", "Great!",
+boilerplate titles). Predictions are cached under a hash of the normalized
+review text and the model version, so a repeated review skips
+preprocessing, vectorization and prediction entirely. Least recently used
+entries are evicted once the cache reaches its memory limit.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+PREDICTION_CACHE_ENABLED = os.environ.get('PREDICTION_CACHE_ENABLED', '1') == '1'
+# Approximate memory the cache may use before evicting old entries
+PREDICTION_CACHE_MAX_BYTES = int(os.environ.get('PREDICTION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Measured size of one entry: 16-byte digest key, (label, probability)
+# tuple and its OrderedDict slot
+ENTRY_BYTES = 260
+
+whitespace_pattern = re.compile(r'\s+')
+
+
+def normalize_review(text):
+    """
+    Collapse runs of whitespace and drop leading whitespace
+
+    preprocessing() gives the same output for the normalized text, so
+    reviews that differ only in spacing share a cache entry. Trailing
+    whitespace is kept as a single space because it decides whether
+    extracted emoticons are joined to the last word.
+    """
+    return whitespace_pattern.sub(' ', text).lstrip()
+
+
+class PredictionCache:
+    """Thread-safe LRU map from (review text, model version) to a prediction"""
+
+    def __init__(self, max_bytes=PREDICTION_CACHE_MAX_BYTES):
+        self.max_entries = max(max_bytes // ENTRY_BYTES, 1)
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text, model_version):
+        """Return the cache key for a raw review under a model version"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(model_version.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(normalize_review(text).encode('utf-8', 'surrogatepass'))
+        return digest.digest()
+
+    def get_many(self, keys):
+        """Return the cached value for each key, or None where missing"""
+        entries = self._entries
+        results = []
+        with self._lock:
+            for key in keys:
+                value = entries.get(key)
+                if value is not None:
+                    entries.move_to_end(key)
+                results.append(value)
+            hits = sum(value is not None for value in results)
+            self.counters['hits'] += hits
+            self.counters['misses'] += len(results) - hits
+        return results
+
+    def put_many(self, items):
+        """Store (key, value) pairs, evicting the least recently used entries"""
+        entries = self._entries
+        with self._lock:
+            for key, value in items:
+                entries[key] = value
+                entries.move_to_end(key)
+            overflow = len(entries) - self.max_entries
+            for _ in range(max(overflow, 0)):
+                entries.popitem(last=False)
+            self.counters['evictions'] += max(overflow, 0)
+
+    def clear(self):
+        """Drop every entry, e.g. after the served model changes"""
+        with self._lock:
+            self._entries.clear()
+            self.counters['invalidations'] += 1
+
+    def stats(self):
+        """Return hit/miss counters plus current entry count and approximate size"""
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return dict(self.counters, entries=len(self._entries),
+                        bytes=len(self._entries) * ENTRY_BYTES,
+                        max_entries=self.max_entries,
+                        hit_rate=round(self.counters['hits'] / lookups, 4) if lookups else 0.0)
+
+
+prediction_cache = PredictionCache() if PREDICTION_CACHE_ENABLED else None
@@ -0,0 +1,181 @@
+"""
+Persistent store of scored reviews
+Every review analysed for a known product is kept in a small SQLite file,
+keyed by product ID and a hash of the review text, together with its
+prediction and the version of the model that made it. Analysing the same
+product again only scores reviews that are new or were scored by an older
+model; everything else is read back from the store. The primary key doubles
+as the per-product index.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+from prediction_cache import normalize_review
+from scrape_cache import cache_key
+
+REVIEW_STORE_ENABLED = os.environ.get('REVIEW_STORE_ENABLED', '1') == '1'
+# A relative path is resolved against the app directory, like MODEL_DIR
+REVIEW_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.environ.get('REVIEW_STORE_PATH', 'cache/reviews.sqlite3'))
+
+# Hashes per lookup query, under SQLite's default host parameter limit
+LOOKUP_BATCH = 500
+
+
+def product_id(url):
+    """Return the stored product identity for a product or review page URL"""
+    key = cache_key(url)
+    if key.startswith('amazon:'):
+        # Every review page of an ASIN is the same product
+        return key.rsplit(':', 1)[0]
+    return key
+
+
+def product_host(product):
+    """Host a stored product ID was scraped from, which picks its model category"""
+    if product.startswith('amazon:'):
+        return product.split(':')[1]
+    return urlsplit(product).netloc
+
+
+def content_hash(review):
+    """Hash of a review's text; reviews with the same prediction share it"""
+    return hashlib.blake2b(normalize_review(review).encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class ReviewStore:
+    """SQLite table of (product, review) -> prediction and model version"""
+
+    def __init__(self, path=REVIEW_STORE_PATH):
+        self.path = path
+        self.counters = {'stored': 0, 'new': 0, 'rescored': 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # Reopened after a fork; a SQLite connection must not cross processes
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._pid = os.getpid()
+            # Several web workers and the nightly script share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS reviews (
+                    product_id TEXT NOT NULL,
+                    content_hash BLOB NOT NULL,
+                    review TEXT NOT NULL,
+                    label INTEGER NOT NULL,
+                    probability REAL NOT NULL,
+                    model_version TEXT NOT NULL,
+                    scored_at REAL NOT NULL,
+                    PRIMARY KEY (product_id, content_hash)
+                ) WITHOUT ROWID
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, product, hashes):
+        """Return {content hash: (label, probability, model version)} for the stored hashes of a product"""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(hashes), LOOKUP_BATCH):
+                batch = hashes[start:start + LOOKUP_BATCH]
+                rows = conn.execute(
+                    "SELECT content_hash, label, probability, model_version FROM reviews "
+                    f"WHERE product_id = ? AND content_hash IN ({','.join('?' * len(batch))})",
+                    [product, *batch]).fetchall()
+                found.update((row[0], tuple(row[1:])) for row in rows)
+        return found
+
+    def save(self, product, scored, model_version):
+        """Insert or update (review, (label, probability)) pairs scored by one model version"""
+        now = time.time()
+        rows = [(product, content_hash(review), review, int(label), float(probability), model_version, now)
+                for review, (label, probability) in scored]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+
+    def predictions(self, items, model_version, score):
+        """
+        Return (label, probability) pairs for (product, reviews) items, scoring only what the store can't answer
+
+        Reviews not stored for their product, or stored under another model
+        version, are passed to score(reviews) in a single call, once per
+        product, and saved. Items whose product is None are scored but not
+        stored.
+        """
+        plans = []
+        pending_reviews = []
+        outdated = 0
+        for product, reviews in items:
+            hashes = [content_hash(review) for review in reviews]
+            known = self.lookup(product, hashes) if product is not None else {}
+            pending = {}
+            for review, digest in zip(reviews, hashes):
+                entry = known.get(digest)
+                if (entry is None or entry[2] != model_version) and digest not in pending:
+                    pending[digest] = review
+                    outdated += entry is not None
+            plans.append((product, hashes, known, pending))
+            pending_reviews.extend(pending.values())
+
+        scored = iter(score(pending_reviews) if pending_reviews else [])
+        results = []
+        for product, hashes, known, pending in plans:
+            fresh = [(review, next(scored)) for review in pending.values()]
+            if product is not None and fresh:
+                self.save(product, fresh, model_version)
+            for digest, (_, result) in zip(pending, fresh):
+                known[digest] = tuple(result)
+            results.append([known[digest][:2] for digest in hashes])
+
+        with self._lock:
+            self.counters['stored'] += sum(len(known) - len(pending) for _, _, known, pending in plans)
+            self.counters['new'] += len(pending_reviews) - outdated
+            self.counters['rescored'] += outdated
+        return results
+
+    def summary(self, product):
+        """Return (positive, negative) counts over every stored review of a product"""
+        with self._lock:
+            conn = self._connect()
+            positive, negative = conn.execute(
+                "SELECT COALESCE(SUM(label = 1), 0), COALESCE(SUM(label = 0), 0) FROM reviews WHERE product_id = ?",
+                (product,)).fetchone()
+        return positive, negative
+
+    def stale(self, product, model_version):
+        """Return a product's stored reviews that were scored by a model other than model_version"""
+        with self._lock:
+            conn = self._connect()
+            return [row[0] for row in conn.execute(
+                "SELECT review FROM reviews WHERE product_id = ? AND model_version != ?", (product, model_version))]
+
+    def products(self):
+        """Return every stored product ID"""
+        with self._lock:
+            conn = self._connect()
+            return [row[0] for row in conn.execute("SELECT DISTINCT product_id FROM reviews")]
+
+    def stats(self):
+        """Return per-call counters plus stored review and product counts"""
+        with self._lock:
+            conn = self._connect()
+            reviews, products = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT product_id) FROM reviews").fetchone()
+            return dict(self.counters, reviews=reviews, products=products)
+
+
+review_store = ReviewStore() if REVIEW_STORE_ENABLED else None
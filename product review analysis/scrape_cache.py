@@ -0,0 +1,189 @@
+"""
+Persistent on-disk cache for scraped review pages
+Pages are stored in a small SQLite file keyed by product identity (the ASIN
+and review page for Amazon, the canonical URL otherwise). Entries younger
+than the TTL are served without touching the network; older entries are
+revalidated with ETag/Last-Modified, and the least recently used pages are
+evicted once the cache grows past its size limit.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+SCRAPE_CACHE_ENABLED = os.environ.get('SCRAPE_CACHE_ENABLED', '1') == '1'
+# A relative path is resolved against the app directory, like MODEL_DIR
+SCRAPE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.environ.get('SCRAPE_CACHE_PATH', 'cache/scrape_cache.sqlite3'))
+# Seconds a cached page is served without revalidation
+SCRAPE_CACHE_TTL = int(os.environ.get('SCRAPE_CACHE_TTL', 3600))
+# Total page bytes kept before least recently used pages are evicted
+SCRAPE_CACHE_MAX_BYTES = int(os.environ.get('SCRAPE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Seconds between updates of a page's last access time; eviction order only
+# needs to be roughly right, and most hits then read without writing
+ACCESS_UPDATE_INTERVAL = 60
+
+asin_pattern = re.compile(r'/(?:dp|product|product-reviews)/([A-Z0-9]{10})')
+
+
+def cache_key(url):
+    """Return the normalized product identity for a page URL"""
+    parsed = urlsplit(url)
+    host = parsed.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+
+    if 'amazon' in host:
+        asin_match = asin_pattern.search(parsed.path)
+        if asin_match:
+            page = dict(parse_qsl(parsed.query)).get('pageNumber', '1')
+            return f'amazon:{host}:{asin_match.group(1)}:{page}'
+
+    # Canonical URL: no fragment, no tracking parameters, sorted query
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parsed.query)
+                             if not k.lower().startswith('utm_')))
+    path = parsed.path.rstrip('/') or '/'
+    return f'{parsed.scheme.lower()}://{host}{path}' + (f'?{query}' if query else '')
+
+
+class ScrapeCache:
+    """SQLite-backed page cache with TTL, revalidation and LRU size eviction"""
+
+    def __init__(self, path=SCRAPE_CACHE_PATH, ttl=SCRAPE_CACHE_TTL, max_bytes=SCRAPE_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'revalidated': 0, 'evictions': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # Reopened after a fork; a SQLite connection must not cross processes
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._pid = os.getpid()
+            # Several web workers share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, key):
+        """
+        Return (entry, fresh) for a key
+
+        entry is None on a miss. fresh is True when the entry is within the
+        TTL and can be used without revalidation. A cache that can't be read
+        counts as a miss, so the page is fetched as usual.
+        """
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT url, content, etag, last_modified, fetched_at, accessed_at FROM pages WHERE key = ?",
+                    (key,)).fetchone()
+                if row is not None and time.time() - row[5] >= ACCESS_UPDATE_INTERVAL:
+                    conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    conn.commit()
+            except sqlite3.Error:
+                logger.exception("Scrape cache lookup failed for %s", key)
+                self.counters['errors'] += 1
+                row = None
+            if row is None:
+                self.counters['misses'] += 1
+                return None, False
+
+            entry = {
+                'url': row[0],
+                'content': row[1],
+                'etag': row[2],
+                'last_modified': row[3],
+                'fetched_at': row[4],
+            }
+            fresh = time.time() - entry['fetched_at'] < self.ttl
+            self.counters['hits' if fresh else 'stale'] += 1
+            return entry, fresh
+
+    def revalidated(self, key):
+        """Mark a stale entry as fresh again after a 304 Not Modified"""
+        with self._lock:
+            self.counters['revalidated'] += 1
+            try:
+                conn = self._connect()
+                now = time.time()
+                conn.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+                conn.commit()
+            except sqlite3.Error:
+                logger.exception("Scrape cache update failed for %s", key)
+                self.counters['errors'] += 1
+
+    def store(self, key, url, content, etag=None, last_modified=None):
+        """Insert or replace a page and evict old pages if over the size limit"""
+        with self._lock:
+            try:
+                conn = self._connect()
+                now = time.time()
+                conn.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, url, content, etag, last_modified, now, now, len(content)))
+                self._evict(conn)
+                conn.commit()
+            except sqlite3.Error:
+                # The page itself was fetched fine; it just isn't cached
+                logger.exception("Scrape cache store failed for %s", key)
+                self.counters['errors'] += 1
+                if self._conn is not None:
+                    self._conn.rollback()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM pages ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self.counters['evictions'] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """Remove every cached page"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM pages")
+            conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters plus current entry count and size"""
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            lookups = self.counters['hits'] + self.counters['stale'] + self.counters['misses']
+            served = self.counters['hits'] + self.counters['revalidated']
+            return dict(self.counters, entries=entries, bytes=size,
+                        hit_rate=round(served / lookups, 4) if lookups else 0.0)
+
+
+scrape_cache = ScrapeCache() if SCRAPE_CACHE_ENABLED else None
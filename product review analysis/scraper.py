@@ -0,0 +1,360 @@
+"""
+Review scraping for product comparison
+All page fetches go through one pooled requests session and a shared thread
+pool, so several products (and several review pages per product) are
+fetched concurrently under per-host limits and an overall deadline.
+Fetched pages are kept in the on-disk scrape cache (see scrape_cache.py).
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from dedup import make_deduplicator
+from extraction import CompiledSelectors
+from metrics import scrape_stage_seconds, scraped_reviews, selector_hits, scrape_failures
+from scrape_cache import scrape_cache, cache_key
+
+logger = logging.getLogger(__name__)
+
+AMAZON_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+GENERIC_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5'
+}
+
+# Per-request timeout (seconds), same as the original single-fetch scraper
+REQUEST_TIMEOUT = 15
+# Overall deadline for one scrape call covering every URL and page
+SCRAPE_DEADLINE = float(os.environ.get('SCRAPE_DEADLINE', 30))
+# Number of /product-reviews/ pages fetched per Amazon product
+AMAZON_REVIEW_PAGES = int(os.environ.get('AMAZON_REVIEW_PAGES', 3))
+# Simultaneous requests allowed against a single host
+MAX_CONCURRENT_PER_HOST = int(os.environ.get('MAX_CONCURRENT_PER_HOST', 4))
+# Fetch threads shared by all scrape calls in the process
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 16))
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=FETCH_WORKERS)
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+
+_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='scrape')
+
+# Requests in flight per host, across all scrape calls in the process. Pages
+# wait in their scrape call's queue for a free slot, so a call with many pages
+# on one host never ties up fetch threads that other calls could use
+_host_active = {}
+_host_changed = threading.Condition()
+
+
+def _release_host(host):
+    with _host_changed:
+        _host_active[host] -= 1
+        _host_changed.notify_all()
+
+
+def fetch(url, headers, deadline, site='generic'):
+    """GET a page through the pooled session within the deadline"""
+    with scrape_stage_seconds.time(stage='fetch', site=site):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Deadline reached before fetching {url}")
+        return session.get(url, headers=headers, timeout=min(REQUEST_TIMEOUT, remaining))
+
+
+def fetch_page(url, headers, deadline, site='generic'):
+    """
+    Return (status_code, content) for a page, going through the scrape cache
+
+    Fresh cache entries skip the network entirely; stale ones are revalidated
+    with If-None-Match/If-Modified-Since and reused on 304 Not Modified.
+    """
+    if scrape_cache is None:
+        response = fetch(url, headers, deadline, site)
+        return response.status_code, response.content
+
+    key = cache_key(url)
+    entry, fresh = scrape_cache.lookup(key)
+    if fresh:
+        logger.debug("Cache hit: %s", url)
+        return 200, entry['content']
+
+    if entry is not None:
+        headers = dict(headers)
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    response = fetch(url, headers, deadline, site)
+    if entry is not None and response.status_code == 304:
+        logger.debug("Cache revalidated: %s", url)
+        scrape_cache.revalidated(key)
+        return 200, entry['content']
+
+    if response.status_code == 200:
+        scrape_cache.store(key, url, response.content,
+                           response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return response.status_code, response.content
+
+
+def amazon_review_page_urls(url, pages=AMAZON_REVIEW_PAGES):
+    """Return the review page URLs to fetch for an Amazon product URL"""
+    # If it's a product page, try to get the reviews pages
+    if '/dp/' in url or '/product/' in url:
+        # Extract ASIN
+        asin_match = re.search(r'/dp/([A-Z0-9]{10})', url)
+        if not asin_match:
+            asin_match = re.search(r'/product/([A-Z0-9]{10})', url)
+
+        if asin_match:
+            asin = asin_match.group(1)
+            domain = 'amazon.com' if 'amazon.com' in url else 'amazon.in'
+            reviews_url = f'https://www.{domain}/product-reviews/{asin}'
+            logger.info("Trying reviews URL: %s", reviews_url)
+            return [reviews_url] + [f'{reviews_url}?pageNumber={page}' for page in range(2, pages + 1)]
+
+    return [url]
+
+
+# Amazon review body selectors, in priority order
+AMAZON_BODY_SELECTORS = [
+    ('span', {'data-hook': 'review-body'}),
+    ('div', {'data-hook': 'review-body'}),
+    ('div', {'class': 'review-text-content'}),
+    ('div', {'class': 'a-expander-content reviewText review-text-content'}),
+    ('span', {'class': 'review-text-content'}),
+]
+
+AMAZON_TITLE_SELECTORS = [
+    ('a', {'data-hook': 'review-title'}),
+    ('span', {'data-hook': 'review-title'}),
+    ('div', {'data-hook': 'review-title'}),
+]
+
+# Common review patterns on other sites, all matched against p/div/span
+GENERIC_SELECTORS = [
+    {'class': re.compile(r'review', re.I)},
+    {'class': re.compile(r'comment', re.I)},
+    {'class': re.compile(r'feedback', re.I)},
+    {'itemprop': 'reviewBody'},
+    {'itemprop': 'description'},
+    {'data-hook': re.compile(r'review', re.I)},
+]
+
+amazon_selectors = CompiledSelectors(AMAZON_BODY_SELECTORS + AMAZON_TITLE_SELECTORS, site='amazon')
+generic_selectors = CompiledSelectors([(['p', 'div', 'span'], attrs) for attrs in GENERIC_SELECTORS], site='generic')
+
+
+def selector_label(tag, attrs):
+    """Short, stable name for a selector, e.g. span[data-hook=review-body]"""
+    rules = ','.join(f"{attr}={getattr(rule, 'pattern', rule)}" for attr, rule in attrs.items())
+    return f'{tag}[{rules}]'
+
+star_rating_pattern = re.compile(r'^\d+\.\d+\s+out of \d+ stars\s*')
+
+
+def extract_amazon_reviews(html, max_reviews=50, dedup=None):
+    """
+    Extract review bodies and titles from one Amazon page
+
+    dedup is shared across a product's pages so that a review seen on an
+    earlier page, or through another selector, is only returned once.
+    """
+    dedup = dedup or make_deduplicator('amazon')
+    reviews = []
+    matches = amazon_selectors.select(html)
+    body_matches = matches[:len(AMAZON_BODY_SELECTORS)]
+    title_matches = matches[len(AMAZON_BODY_SELECTORS):]
+
+    # Try multiple Amazon review selectors
+    for (tag, attrs), review_elements in zip(AMAZON_BODY_SELECTORS, body_matches):
+        if review_elements:
+            logger.debug("Found %d reviews with selector: %s %s", len(review_elements), tag, attrs)
+            selector_hits.inc(len(review_elements), site='amazon', selector=selector_label(tag, attrs))
+            for element in review_elements[:max_reviews]:
+                review_text = element.get_text(strip=True)
+                # Clean up common Amazon text
+                review_text = review_text.replace('Read more', '').strip()
+                if review_text and len(review_text) > 15 and dedup.add(review_text):
+                    reviews.append(review_text)
+            if reviews:
+                break
+
+    # Also get review titles
+    for (tag, attrs), title_elements in zip(AMAZON_TITLE_SELECTORS, title_matches):
+        if title_elements:
+            logger.debug("Found %d titles with selector: %s %s", len(title_elements), tag, attrs)
+            selector_hits.inc(len(title_elements), site='amazon', selector=selector_label(tag, attrs))
+            for element in title_elements[:max_reviews]:
+                title_text = element.get_text(strip=True)
+                # Remove star ratings from titles
+                title_text = star_rating_pattern.sub('', title_text)
+                if title_text and len(title_text) > 5 and dedup.add(title_text):
+                    reviews.append(title_text)
+            if len(reviews) >= 10:
+                break
+
+    return reviews
+
+
+def extract_generic_reviews(html, max_reviews=50, dedup=None):
+    """Extract reviews from an arbitrary product page"""
+    dedup = dedup or make_deduplicator('generic')
+    reviews = []
+
+    for selector, elements in zip(GENERIC_SELECTORS, generic_selectors.select(html)):
+        logger.debug("Found %d elements with selector: %s", len(elements), selector)
+        if elements:
+            selector_hits.inc(len(elements), site='generic', selector=selector_label('p|div|span', selector))
+        for element in elements[:max_reviews]:
+            text = element.get_text(strip=True)
+            if text and 20 < len(text) < 500 and dedup.add(text):
+                reviews.append(text)
+
+        if len(reviews) >= 10:
+            break
+
+    return reviews[:max_reviews]
+
+
+def _dispatch(pages, deadline):
+    """
+    Fetch pages under the per-host limit; returns {(job, page): future}
+
+    pages holds (job, page, url, headers, site) tuples. Each page is handed
+    to the fetch threads only once its host has a free slot, and this call
+    waits for slots and results until everything is done or the deadline
+    passes. Pages still queued at the deadline get no future.
+    """
+    queues = {}
+    for item in pages:
+        queues.setdefault(urlparse(item[2]).netloc.lower(), deque()).append(item)
+
+    futures = {}
+    with _host_changed:
+        while True:
+            for host, queue in queues.items():
+                while queue and _host_active.get(host, 0) < MAX_CONCURRENT_PER_HOST:
+                    job, page, url, headers, site = queue.popleft()
+                    _host_active[host] = _host_active.get(host, 0) + 1
+                    future = _executor.submit(fetch_page, url, headers, deadline, site)
+                    future.add_done_callback(lambda _, host=host: _release_host(host))
+                    futures[job, page] = future
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (not any(queues.values()) and all(f.done() for f in futures.values())):
+                return futures
+            # Woken whenever any scrape call's request finishes
+            _host_changed.wait(remaining)
+
+
+def _scrape(jobs, max_reviews, timeout):
+    """
+    Fetch every page of every job concurrently, then extract reviews
+
+    jobs is a list of (site, url) pairs with site 'amazon' or 'generic'.
+    Returns one (reviews, timed_out) pair per job, in order. Pages not
+    fetched by the deadline are dropped rather than waited for, and their
+    job is marked timed_out.
+    """
+    deadline = time.monotonic() + timeout
+    plans = []
+    for site, url in jobs:
+        if site == 'amazon':
+            plans.append((site, amazon_review_page_urls(url), AMAZON_HEADERS))
+        else:
+            plans.append((site, [url], GENERIC_HEADERS))
+
+    # Round-robin over jobs, so the first pages of every product go out first
+    pages = [(job, page, page_urls[page], headers, site)
+             for page in range(max(len(plan[1]) for plan in plans))
+             for job, (site, page_urls, headers) in enumerate(plans) if page < len(page_urls)]
+    futures = _dispatch(pages, deadline)
+
+    results = []
+    for job, (site, page_urls, headers) in enumerate(plans):
+        reviews = []
+        timed_out = False
+        dedup = make_deduplicator(site)
+        for page, page_url in enumerate(page_urls):
+            future = futures.get((job, page))
+            if future is None or not future.done():
+                if future is not None:
+                    future.cancel()
+                timed_out = True
+                logger.warning("Deadline reached, skipping %s", page_url)
+                scrape_failures.inc(site=site, reason='deadline')
+                continue
+            try:
+                status_code, content = future.result()
+                logger.info("%s scraper - Response status %s for %s", site, status_code, page_url)
+                if status_code != 200:
+                    scrape_failures.inc(site=site, reason='http_status')
+                if site == 'amazon':
+                    page_reviews = extract_amazon_reviews(content, max_reviews, dedup)
+                else:
+                    page_reviews = extract_generic_reviews(content, max_reviews, dedup)
+                if status_code == 200 and not page_reviews:
+                    scrape_failures.inc(site=site, reason='no_reviews')
+                reviews.extend(page_reviews)
+            except (TimeoutError, requests.Timeout):
+                timed_out = True
+                logger.warning("Deadline reached, skipping %s", page_url)
+                scrape_failures.inc(site=site, reason='deadline')
+            except Exception:
+                logger.exception("Error scraping %s", page_url)
+                scrape_failures.inc(site=site, reason='error')
+
+        reviews = reviews[:max_reviews]
+        scraped_reviews.inc(len(reviews), site=site)
+        logger.info("Total reviews scraped from %s page(s): %d", site, len(reviews))
+        results.append((reviews, timed_out))
+
+    return results
+
+
+def site_for(url):
+    """'amazon' for Amazon URLs, 'generic' for everything else"""
+    domain = urlparse(url).netloc.lower()
+    return 'amazon' if 'amazon' in domain else 'generic'
+
+
+def scrape_amazon_reviews(url, max_reviews=50, timeout=SCRAPE_DEADLINE):
+    """Scrape reviews from Amazon product page"""
+    return _scrape([('amazon', url)], max_reviews, timeout)[0][0]
+
+
+def scrape_generic_reviews(url, max_reviews=50, timeout=SCRAPE_DEADLINE):
+    """Generic scraper for other websites"""
+    return _scrape([('generic', url)], max_reviews, timeout)[0][0]
+
+
+def scrape_reviews_from_url(url, max_reviews=50, timeout=SCRAPE_DEADLINE):
+    """Main function to scrape reviews based on URL"""
+    return _scrape([(site_for(url), url)], max_reviews, timeout)[0][0]
+
+
+def scrape_reviews_from_urls(urls, max_reviews=50, timeout=SCRAPE_DEADLINE):
+    """Scrape several product URLs concurrently; returns one review list per URL"""
+    return [reviews for reviews, _ in _scrape([(site_for(url), url) for url in urls], max_reviews, timeout)]
+
+
+def scrape_products(urls, max_reviews=50, timeout=SCRAPE_DEADLINE):
+    """Like scrape_reviews_from_urls, but returns (reviews, timed_out) per URL"""
+    return _scrape([(site_for(url), url) for url in urls], max_reviews, timeout)
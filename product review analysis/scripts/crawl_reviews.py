@@ -0,0 +1,110 @@
+"""
+Crawl reviews for a file of product URLs, then score them in one pass
+Reads one product URL per line (blank lines and # comments are skipped),
+crawls them through the per-host scheduler in crawler.py and streams each
+finished product to a JSON Lines review file. Running the same command
+again resumes: products already in the review file are skipped.
+
+Once the crawl is done, every product's reviews are scored together in
+large batches (through the review store when it is enabled) and the
+per-product sentiment is written to a second JSON Lines file. Products
+are scored by their site's own model when one exists (see
+model_registry.py).
+
+Usage:
+    python scripts/crawl_reviews.py urls.txt
+    python scripts/crawl_reviews.py urls.txt --output crawl.jsonl --host-rate 1
+    python scripts/crawl_reviews.py urls.txt --no-sentiment   # crawl only
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import crawler
+from crawler import CrawlScheduler, read_checkpoint, write_record
+from model_registry import category_for_url
+from review_store import product_id
+
+# Products scored per model call in the sentiment pass
+SENTIMENT_BATCH_PRODUCTS = 500
+
+
+def read_urls(path):
+    with open(path) as f:
+        urls = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    return list(dict.fromkeys(urls))
+
+
+def crawl(urls, output, scheduler, max_reviews, retry_failed):
+    done = read_checkpoint(output)
+    todo = [url for url in urls if url not in done or (retry_failed and done[url]['error'])]
+    print(f"🕷️  Crawling {len(todo)} products ({len(urls) - len(todo)} already in {output})")
+
+    started = time.perf_counter()
+    finished = failed = 0
+    with open(output, 'a', encoding='utf-8') as f:
+        for url, reviews, error in scheduler.crawl(todo, max_reviews):
+            write_record(f, url, product_id(url), reviews, error)
+            finished += 1
+            failed += error is not None
+            if finished % 100 == 0 or finished == len(todo):
+                elapsed = time.perf_counter() - started
+                print(f"   {finished}/{len(todo)} products, {failed} failed, "
+                      f"{finished / max(elapsed, 1e-9):.1f} products/s")
+    print(f"✅ Crawled {finished} products in {time.perf_counter() - started:.1f}s "
+          f"({scheduler.counters['retries']} retries, {scheduler.counters['failed_pages']} failed pages)")
+
+
+def score(urls, output, sentiment_output):
+    # Imported here so a crawl-only run doesn't load the models
+    import backend
+
+    records = read_checkpoint(output)
+    products = [records[url] for url in urls if url in records]
+    print(f"🤖 Scoring {sum(len(record['reviews']) for record in products)} reviews "
+          f"from {len(products)} products...")
+    started = time.perf_counter()
+    with open(sentiment_output, 'w', encoding='utf-8') as f:
+        for start in range(0, len(products), SENTIMENT_BATCH_PRODUCTS):
+            batch = products[start:start + SENTIMENT_BATCH_PRODUCTS]
+            results = backend.analyze_many([record['reviews'] for record in batch],
+                                           [record['product_id'] for record in batch],
+                                           [category_for_url(record['url']) for record in batch])
+            for record, result in zip(batch, results):
+                row = {'url': record['url'], 'product_id': record['product_id']}
+                row.update(result or {'error': record['error'] or 'No reviews found'})
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    print(f"✅ Scored in {time.perf_counter() - started:.1f}s, sentiment written to {sentiment_output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl reviews for many product URLs and score them")
+    parser.add_argument('urls', help="file with one product URL per line")
+    parser.add_argument('--output', default='crawl_reviews.jsonl', help="review file, also the resume checkpoint")
+    parser.add_argument('--sentiment', help="per-product sentiment file (default: <output>.sentiment.jsonl)")
+    parser.add_argument('--no-sentiment', action='store_true', help="crawl only, skip scoring")
+    parser.add_argument('--retry-failed', action='store_true', help="crawl products that failed last time again")
+    parser.add_argument('--max-reviews', type=int, default=50, help="reviews kept per product")
+    parser.add_argument('--workers', type=int, default=crawler.CRAWL_WORKERS, help="pages fetched at once")
+    parser.add_argument('--host-concurrency', type=int, default=crawler.CRAWL_HOST_CONCURRENCY,
+                        help="pages fetched at once from one host")
+    parser.add_argument('--host-rate', type=float, default=crawler.CRAWL_HOST_RATE,
+                        help="requests per second per host (0 for no limit)")
+    parser.add_argument('--retries', type=int, default=crawler.CRAWL_RETRIES,
+                        help="retries of a page answered with 429/503")
+    args = parser.parse_args()
+
+    urls = read_urls(args.urls)
+    scheduler = CrawlScheduler(workers=args.workers, host_concurrency=args.host_concurrency,
+                               host_rate=args.host_rate, retries=args.retries)
+    crawl(urls, args.output, scheduler, args.max_reviews, args.retry_failed)
+    if not args.no_sentiment:
+        score(urls, args.output, args.sentiment or f'{os.path.splitext(args.output)[0]}.sentiment.jsonl')
+
+
+if __name__ == "__main__":
+    main()
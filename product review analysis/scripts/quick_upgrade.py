@@ -2,31 +2,18 @@
 Quick Model Upgrade - Retrain with sample data to fix version warnings
 """
 
-import pickle
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegressionCV
-import re
-import nltk
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
+import os
+import sys
 
-# Download NLTK data
-try:
-    stopwords_set = set(stopwords.words('english'))
-except LookupError:
-    nltk.download('stopwords')
-    stopwords_set = set(stopwords.words('english'))
-
-emoticon_pattern = re.compile(r'(?::|;|=)(?:-)?(?:\)|\(|D|P)')
-
-def preprocessing(text):
-    text = re.sub('<[^>]*>', '', text)
-    emojis = emoticon_pattern.findall(text)
-    text = re.sub(r'[\W+]', ' ', text.lower()) + ' '.join(emojis).replace('-', '')
-    prter = PorterStemmer()
-    text = [prter.stem(word) for word in text.split() if word not in stopwords_set]
-    return " ".join(text)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_artifact import save_models
+from model_registry import MODEL_DIR, model_paths
+from fused_scorer import FusedScorer, check_equivalence
+from text_preprocessing import preprocess_batch
+from corpus_cache import preprocess_cached, texts_digest
 
 # Sample training data
 reviews = [
@@ -50,7 +37,8 @@ labels = [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0,
           1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0]
 
 print("🔄 Preprocessing reviews...")
-processed_reviews = [preprocessing(r) for r in reviews]
+# Same corpus cache as upgrade_model.py, keyed by the sample texts themselves
+processed_reviews, _ = preprocess_cached(reviews, texts_digest(reviews), 'review_title', preprocess_batch)
 
 print("🔤 Training TF-IDF Vectorizer...")
 tfidf = TfidfVectorizer(max_features=5000, ngram_range=(1, 2))
@@ -60,14 +48,20 @@ print("🤖 Training Logistic Regression model...")
 clf = LogisticRegressionCV(cv=3, random_state=42, max_iter=1000)
 clf.fit(X, labels)
 
-print("💾 Saving upgraded models...")
-with open('models/clf.pkl', 'wb') as f:
-    pickle.dump(clf, f)
-print("✅ Saved models/clf.pkl")
+# Checked before the served models are replaced; the app picks up new files by itself
+try:
+    _, max_difference = check_equivalence(FusedScorer.from_models(clf, tfidf), clf, tfidf, processed_reviews)
+except ValueError as e:
+    sys.exit(f"❌ {e}; the served models were not replaced")
+print(f"✅ Fused scorer matches sklearn (max diff {max_difference:.2g})")
 
-with open('models/tfidf.pkl', 'wb') as f:
-    pickle.dump(tfidf, f)
-print("✅ Saved models/tfidf.pkl")
+print("💾 Saving upgraded models...")
+clf_path, tfidf_path, artifact_path = model_paths(MODEL_DIR)
+os.makedirs(MODEL_DIR, exist_ok=True)
+save_models(clf, tfidf, clf_path, tfidf_path, artifact_path)
+print(f"✅ Saved {clf_path}")
+print(f"✅ Saved {tfidf_path}")
+print(f"✅ Saved {artifact_path} (memory-mapped by the app)")
 
 print("\n🎉 Models upgraded successfully!")
 print("⚠️  Note: These are trained on sample data. For production, use upgrade_model.py with your real data.")
@@ -0,0 +1,62 @@
+"""
+Rescore stored reviews after a model upgrade
+Reviews in the review store that were scored by an older model are scored
+again with the current one, in batches, so the next analysis of each
+product is served from the store. Each product is rescored with the model
+of its category (the host it was scraped from), or the default model when
+the category has none. Reviews scored by the current model are not
+touched. Intended to run nightly, after any model upgrade.
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backend
+from review_store import product_host, review_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=10000, help='stored reviews rescored per model call')
+    parser.add_argument('--summary', action='store_true', help='print per-product sentiment from the store')
+    args = parser.parse_args()
+
+    if review_store is None:
+        sys.exit("❌ The review store is disabled (REVIEW_STORE_ENABLED=0)")
+
+    # Products grouped by the category whose models serve them
+    by_category = defaultdict(list)
+    for product in review_store.products():
+        by_category[backend.registry.resolve(product_host(product))].append(product)
+
+    started = time.perf_counter()
+    rescored = 0
+    for category, products in by_category.items():
+        current = backend.models_for(category)
+        print(f"🔄 Rescoring {category or 'default'} reviews scored before model version {current['version']}...")
+        batch, size = [], 0
+        for index, product in enumerate(products):
+            stale = review_store.stale(product, current['version'])
+            if stale:
+                batch.append((product, stale))
+                size += len(stale)
+            if batch and (size >= args.batch_size or index == len(products) - 1):
+                review_store.predictions(batch, current['version'],
+                                         lambda reviews: backend.predict_with_models(current, reviews))
+                rescored += size
+                batch, size = [], 0
+                print(f"   {rescored} reviews rescored")
+    print(f"✅ Rescored {rescored} reviews in {time.perf_counter() - started:.1f}s")
+
+    if args.summary:
+        for product in review_store.products():
+            positive, negative = review_store.summary(product)
+            print(f"{product}: {backend.summarize_counts(positive, negative)}")
+
+
+if __name__ == "__main__":
+    main()
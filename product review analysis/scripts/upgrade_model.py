@@ -4,35 +4,39 @@ This script helps you retrain your model with the current scikit-learn version (
 """
 
 import pickle
+import zlib
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegressionCV
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegressionCV, SGDClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
-import re
-import nltk
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
+import os
+import sys
 
-# Download required NLTK data
-try:
-    stopwords_set = set(stopwords.words('english'))
-except LookupError:
-    nltk.download('stopwords')
-    stopwords_set = set(stopwords.words('english'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_artifact import save_models
+from model_registry import MODEL_DIR, category_pattern, model_paths
+from fused_scorer import FusedScorer, check_equivalence
+from parallel import init_pool, preprocess_parallel
+from corpus_cache import (CorpusStream, corpus_key, features_key, file_digest,
+                          load_features, preprocess_cached, save_features)
 
-emoticon_pattern = re.compile(r'(?::|;|=)(?:-)?(?:\)|\(|D|P)')
+# Streaming (out-of-core) training settings
+TRAIN_CHUNK_SIZE = int(os.environ.get('TRAIN_CHUNK_SIZE', 100000))
+# Hashed feature space; fixed, so no vocabulary has to be fitted or stored
+TRAIN_HASH_FEATURES = int(os.environ.get('TRAIN_HASH_FEATURES', 2 ** 18))
+# Share of rows held out for evaluation, chosen by a hash of the review text
+# so a review stays on the same side of the split across incremental runs
+HOLDOUT_FRACTION = float(os.environ.get('HOLDOUT_FRACTION', 0.05))
 
-
-def preprocessing(text):
-    """Preprocess text for sentiment analysis"""
-    text = re.sub('<[^>]*>', '', text)
-    emojis = emoticon_pattern.findall(text)
-    text = re.sub(r'[\W+]', ' ', text.lower()) + ' '.join(emojis).replace('-', '')
-    prter = PorterStemmer()
-    text = [prter.stem(word) for word in text.split() if word not in stopwords_set]
-    return " ".join(text)
+# Set to train a category's own model into MODEL_DIR/<category> instead of
+# the default model; the running app picks it up without a restart
+MODEL_CATEGORY = os.environ.get('MODEL_CATEGORY', '').lower()
+if MODEL_CATEGORY and not category_pattern.match(MODEL_CATEGORY):
+    sys.exit(f"❌ Invalid MODEL_CATEGORY {MODEL_CATEGORY!r}")
+MODEL_OUTPUT_DIR = os.path.join(MODEL_DIR, MODEL_CATEGORY) if MODEL_CATEGORY else MODEL_DIR
+CLF_OUTPUT, TFIDF_OUTPUT, ARTIFACT_OUTPUT = model_paths(MODEL_OUTPUT_DIR)
 
 
 def train_model_from_csv(csv_path, review_column='review_title', label_column='sentiment'):
@@ -56,9 +60,15 @@ def train_model_from_csv(csv_path, review_column='review_title', label_column='s
         print("Available columns:", df.columns.tolist())
         return None, None
     
-    # Preprocess reviews
+    # Preprocess reviews (or load them from the corpus cache)
     print("🔄 Preprocessing reviews...")
-    df['processed'] = df[review_column].astype(str).apply(preprocessing)
+    # Shards across the shared pool when PARALLEL_WORKERS is set
+    init_pool()
+    digest = file_digest(csv_path)
+    df['processed'], cache_hit = preprocess_cached(df[review_column].astype(str).tolist(), digest,
+                                                   review_column, preprocess_parallel)
+    if cache_hit:
+        print("♻️  Loaded preprocessed reviews from the corpus cache")
     
     # Split data
     X_train, X_test, y_train, y_test = train_test_split(
@@ -71,11 +81,19 @@ def train_model_from_csv(csv_path, review_column='review_title', label_column='s
     print(f"📚 Training set: {len(X_train)} reviews")
     print(f"🧪 Test set: {len(X_test)} reviews")
     
-    # Train TF-IDF Vectorizer
+    # Train TF-IDF Vectorizer, reusing cached matrices for the same corpus and split
     print("🔤 Training TF-IDF Vectorizer...")
     tfidf = TfidfVectorizer(max_features=5000, ngram_range=(1, 2))
-    X_train_tfidf = tfidf.fit_transform(X_train)
-    X_test_tfidf = tfidf.transform(X_test)
+    key = features_key(corpus_key(digest, review_column), tfidf, test_size=0.2, random_state=42)
+    cached = load_features(key)
+    if cached is not None:
+        tfidf, matrices = cached
+        X_train_tfidf, X_test_tfidf = matrices['train'], matrices['test']
+        print("♻️  Loaded TF-IDF matrices from the corpus cache")
+    else:
+        X_train_tfidf = tfidf.fit_transform(X_train)
+        X_test_tfidf = tfidf.transform(X_test)
+        save_features(key, tfidf, {'train': X_train_tfidf, 'test': X_test_tfidf})
     
     # Train Logistic Regression model
     print("🤖 Training Logistic Regression model...")
@@ -94,20 +112,153 @@ def train_model_from_csv(csv_path, review_column='review_title', label_column='s
     print("\n🎯 Confusion Matrix:")
     print(confusion_matrix(y_test, y_pred))
     
+    # The app scores small batches with the fused scorer; make sure it
+    # agrees with sklearn on the held-out reviews before replacing the
+    # served models, which the app picks up by itself
+    try:
+        _, max_difference = check_equivalence(FusedScorer.from_models(clf, tfidf), clf, tfidf, X_test)
+    except ValueError as e:
+        print(f"❌ {e}; the served models were not replaced")
+        return None, None
+    print(f"✅ Fused scorer matches sklearn on {len(X_test)} test reviews (max diff {max_difference:.2g})")
+    
     # Save models
     print("\n💾 Saving upgraded models...")
-    with open('models/clf.pkl', 'wb') as f:
-        pickle.dump(clf, f)
-    print("✅ Saved models/clf.pkl")
-    
-    with open('models/tfidf.pkl', 'wb') as f:
-        pickle.dump(tfidf, f)
-    print("✅ Saved models/tfidf.pkl")
+    os.makedirs(MODEL_OUTPUT_DIR, exist_ok=True)
+    save_models(clf, tfidf, CLF_OUTPUT, TFIDF_OUTPUT, ARTIFACT_OUTPUT)
+    print(f"✅ Saved {CLF_OUTPUT}")
+    print(f"✅ Saved {TFIDF_OUTPUT}")
+    print(f"✅ Saved {ARTIFACT_OUTPUT} (memory-mapped by the app)")
     
     print("\n🎉 Model upgrade complete!")
     return clf, tfidf
 
 
+def make_hashing_vectorizer():
+    """Stateless featurizer for streaming training"""
+    # alternate_sign=False keeps features non-negative and lets the app's
+    # fused scorer reproduce the transform
+    return HashingVectorizer(n_features=TRAIN_HASH_FEATURES, ngram_range=(1, 2),
+                             alternate_sign=False, norm='l2')
+
+
+def is_holdout(text, fraction=HOLDOUT_FRACTION):
+    """Deterministically assign a review to the holdout set by hashing its text"""
+    return zlib.crc32(text.encode('utf-8', 'surrogatepass')) % 10000 < fraction * 10000
+
+
+def train_model_streaming(csv_path, review_column='review_title', label_column='sentiment',
+                          update=False, chunk_size=TRAIN_CHUNK_SIZE):
+    """
+    Train a hashed-feature logistic model by streaming the CSV in chunks
+
+    Memory use is bounded by chunk_size whatever the size of the CSV. With
+    update=True the existing streamed model in MODEL_OUTPUT_DIR is loaded and the new
+    rows are folded in with partial_fit, without reprocessing earlier data.
+
+    Holdout rows never train the model. Each chunk's holdout rows are scored
+    before the chunk is learned (progressive validation), so the evaluation
+    accumulates as the file streams instead of needing a second pass.
+    """
+    if update:
+        with open(CLF_OUTPUT, 'rb') as f:
+            clf = pickle.load(f)
+        with open(TFIDF_OUTPUT, 'rb') as f:
+            vectorizer = pickle.load(f)
+        if not isinstance(vectorizer, HashingVectorizer) or not hasattr(clf, 'partial_fit'):
+            print(f"⚠️  {MODEL_OUTPUT_DIR} does not hold a streamed model; train one with the streaming mode first")
+            return None, None
+        print(f"📦 Updating the existing streamed model ({vectorizer.n_features} hashed features)")
+    else:
+        vectorizer = make_hashing_vectorizer()
+        clf = SGDClassifier(loss='log_loss', alpha=1e-6, random_state=42)
+
+    classes = np.array([0, 1])
+    confusion = np.zeros((2, 2), dtype=np.int64)
+    log_loss_total = 0.0
+    trained_rows = 0
+    last_holdout = []
+
+    # Shards preprocessing across the shared pool when PARALLEL_WORKERS is set
+    init_pool()
+    print(f"📊 Streaming {csv_path} in chunks of {chunk_size} rows...")
+    corpus = CorpusStream(file_digest(csv_path), review_column, preprocess_parallel)
+    if corpus.hit:
+        print("♻️  Reading preprocessed reviews from the corpus cache")
+    chunks = pd.read_csv(csv_path, usecols=[review_column, label_column], chunksize=chunk_size)
+    try:
+        for number, chunk in enumerate(chunks, 1):
+            # The whole column goes through the cache so it matches the in-memory mode
+            processed = corpus.process(chunk[review_column].astype(str).tolist())
+            labelled = chunk[label_column].notna().to_numpy()
+            texts = [text for text, keep in zip(chunk[review_column].astype(str), labelled) if keep]
+            processed = [text for text, keep in zip(processed, labelled) if keep]
+            labels = chunk[label_column][labelled].astype(int).to_numpy()
+            holdout = np.array([is_holdout(text) for text in texts], dtype=bool)
+            X = vectorizer.transform(processed)
+
+            if holdout.any() and hasattr(clf, 'coef_'):
+                X_holdout, y_holdout = X[holdout], labels[holdout]
+                probabilities = np.clip(clf.predict_proba(X_holdout)[:, 1], 1e-15, 1 - 1e-15)
+                predictions = (probabilities > 0.5).astype(int)
+                np.add.at(confusion, (y_holdout, predictions), 1)
+                log_loss_total -= float(np.sum(y_holdout * np.log(probabilities)
+                                               + (1 - y_holdout) * np.log(1 - probabilities)))
+                last_holdout = [doc for doc, held in zip(processed, holdout) if held]
+
+            if (~holdout).any():
+                clf.partial_fit(X[~holdout], labels[~holdout], classes=classes)
+                trained_rows += int((~holdout).sum())
+
+            evaluated = int(confusion.sum())
+            accuracy = np.trace(confusion) / evaluated if evaluated else float('nan')
+            print(f"   chunk {number}: {trained_rows} rows trained, holdout accuracy {accuracy:.4f} "
+                  f"over {evaluated} reviews")
+    except BaseException:
+        corpus.abort()
+        raise
+    corpus.close()
+
+    if not trained_rows:
+        print("⚠️  No training rows found")
+        return None, None
+
+    evaluated = int(confusion.sum())
+    print("\n📈 Holdout Evaluation (progressive):")
+    if evaluated:
+        print(f"✅ Accuracy: {np.trace(confusion) / evaluated:.4f} over {evaluated} reviews")
+        print(f"📉 Log loss: {log_loss_total / evaluated:.4f}")
+        print("\n🎯 Confusion Matrix:")
+        print(confusion)
+    else:
+        print("⚠️  No holdout reviews were evaluated")
+
+    # Checked before the served models are replaced, as in train_model_from_csv
+    if last_holdout:
+        try:
+            _, max_difference = check_equivalence(FusedScorer.from_models(clf, vectorizer), clf, vectorizer,
+                                                  last_holdout)
+        except ValueError as e:
+            print(f"❌ {e}; the served models were not replaced")
+            return None, None
+        print(f"✅ Fused scorer matches sklearn on {len(last_holdout)} holdout reviews (max diff {max_difference:.2g})")
+
+    print("\n💾 Saving streamed models...")
+    os.makedirs(MODEL_OUTPUT_DIR, exist_ok=True)
+    save_models(clf, vectorizer, CLF_OUTPUT, TFIDF_OUTPUT)
+    print(f"✅ Saved {CLF_OUTPUT}")
+    print(f"✅ Saved {TFIDF_OUTPUT} (hashing vectorizer)")
+
+    # The compiled artifact stores a vocabulary, which a hashed model does not
+    # have; remove a stale one so the app loads the pickles
+    if os.path.exists(ARTIFACT_OUTPUT):
+        os.remove(ARTIFACT_OUTPUT)
+        print(f"🗑️  Removed {ARTIFACT_OUTPUT} (not used with hashed features)")
+
+    print("\n🎉 Streaming training complete!")
+    return clf, vectorizer
+
+
 def create_sample_dataset():
     """Create a sample dataset for demonstration"""
     print("📝 Creating sample dataset...")
@@ -153,9 +304,11 @@ if __name__ == "__main__":
     print("Choose an option:")
     print("1. Train with your own CSV file")
     print("2. Train with sample data (demo)")
+    print("3. Stream-train from a large CSV (out-of-core)")
+    print("4. Fold new labelled reviews into the streamed model")
     print()
     
-    choice = input("Enter your choice (1 or 2): ").strip()
+    choice = input("Enter your choice (1-4): ").strip()
     
     if choice == '1':
         csv_path = input("Enter path to your CSV file: ").strip()
@@ -171,5 +324,13 @@ if __name__ == "__main__":
         print()
         train_model_from_csv(csv_path, 'review_title', 'sentiment')
         
+    elif choice in ('3', '4'):
+        csv_path = input("Enter path to your CSV file: ").strip()
+        review_col = input("Enter review column name (default: review_title): ").strip() or 'review_title'
+        label_col = input("Enter label column name (default: sentiment): ").strip() or 'sentiment'
+        
+        print()
+        train_model_streaming(csv_path, review_col, label_col, update=(choice == '4'))
+        
     else:
         print("❌ Invalid choice!")
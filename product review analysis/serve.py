@@ -0,0 +1,102 @@
+"""
+Production server
+Runs the Flask app under gunicorn with a preloaded app: the master imports
+the backend, which loads the classifier and vectorizer and warms up
+preprocessing and prediction, then freezes the garbage collector before
+forking the workers. Workers start with the models already in memory, and
+since the collector never writes to the frozen objects, their pages stay
+shared copy-on-write between workers instead of being copied into each one.
+
+Usage:
+    python serve.py                          # SERVE_* defaults
+    python serve.py --workers 8 --threads 4 --bind 0.0.0.0:8000
+    kill -HUP $(cat serve.pid)               # graceful worker reload
+"""
+
+import argparse
+import gc
+import logging
+import os
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger(__name__)
+
+SERVE_BIND = os.environ.get('SERVE_BIND', '127.0.0.1:5000')
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1))
+# Threads per worker; more than one uses gunicorn's gthread worker
+SERVE_THREADS = int(os.environ.get('SERVE_THREADS', 4))
+# Requests a worker serves before it is replaced (0 never replaces it),
+# with jitter so that workers don't all restart together. Off by default:
+# a threaded worker closes connections it has accepted but not yet served
+# when it restarts, so with SERVE_THREADS > 1 clients may see a few
+# dropped requests per restart
+SERVE_MAX_REQUESTS = int(os.environ.get('SERVE_MAX_REQUESTS', 0))
+SERVE_MAX_REQUESTS_JITTER = int(os.environ.get('SERVE_MAX_REQUESTS_JITTER', 100))
+# Seconds a request may take before its worker is restarted; synchronous CSV
+# uploads of a million rows take minutes
+SERVE_TIMEOUT = int(os.environ.get('SERVE_TIMEOUT', 300))
+# Seconds old workers get to finish their requests on reload or shutdown
+SERVE_GRACEFUL_TIMEOUT = int(os.environ.get('SERVE_GRACEFUL_TIMEOUT', 30))
+SERVE_PIDFILE = os.environ.get('SERVE_PIDFILE', 'serve.pid')
+
+
+def post_fork(server, worker):
+    """Give each worker its own batch pool; the master's must not be shared"""
+    import parallel
+    parallel.forget_pool()
+    parallel.init_pool()
+
+
+class ReviewServer(BaseApplication):
+    """gunicorn application that loads and warms up the backend once in the master"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import backend
+        if backend.LAZY_STARTUP:
+            backend.warmup()
+        # Everything loaded so far lives as long as the workers; moving it
+        # out of the collector's reach keeps its pages shared after fork
+        gc.collect()
+        gc.freeze()
+        logger.info("Froze %d objects before forking workers", gc.get_freeze_count())
+        return backend.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with preloaded, shared models")
+    parser.add_argument('--bind', default=SERVE_BIND, help="address to listen on")
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS, help="worker processes")
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS, help="threads per worker")
+    parser.add_argument('--max-requests', type=int, default=SERVE_MAX_REQUESTS,
+                        help="requests before a worker is replaced (0 = never)")
+    parser.add_argument('--max-requests-jitter', type=int, default=SERVE_MAX_REQUESTS_JITTER)
+    parser.add_argument('--timeout', type=int, default=SERVE_TIMEOUT, help="seconds before a stuck worker is restarted")
+    parser.add_argument('--graceful-timeout', type=int, default=SERVE_GRACEFUL_TIMEOUT,
+                        help="seconds workers get to finish requests on reload or shutdown")
+    parser.add_argument('--pidfile', default=SERVE_PIDFILE, help="master PID file, for kill -HUP")
+    args = parser.parse_args()
+
+    ReviewServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter if args.max_requests else 0,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'pidfile': args.pidfile,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
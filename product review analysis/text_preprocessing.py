@@ -0,0 +1,69 @@
+"""
+Shared text preprocessing for sentiment analysis
+Used by the Flask backend and the model upgrade scripts so that training
+and serving always normalize reviews the same way.
+
+The English stopword list ships in resources/ (NLTK's list, so no corpus
+download is needed), and NLTK itself is only imported on the first stem.
+"""
+
+import os
+import re
+from functools import lru_cache
+
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'stopwords_english.txt')
+
+with open(STOPWORDS_PATH, encoding='utf-8') as f:
+    stopwords_set = frozenset(line.strip() for line in f if line.strip())
+
+# Bump whenever preprocessing() output changes; cached preprocessed
+# training corpora (corpus_cache.py) are keyed on it
+PREPROCESSING_VERSION = 1
+
+# Review vocabularies repeat heavily, so a bounded cache of stems covers
+# almost every token after the first few thousand reviews
+STEM_CACHE_SIZE = 200000
+
+html_tag_pattern = re.compile(r'<[^>]*>')
+non_word_pattern = re.compile(r'[\W+]')
+emoticon_pattern = re.compile(r'(?::|;|=)(?:-)?(?:\)|\(|D|P)')
+
+
+@lru_cache(maxsize=None)
+def _porter_stemmer():
+    from nltk.stem.porter import PorterStemmer
+    return PorterStemmer()
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    """Porter-stem a single token (memoized)"""
+    return _porter_stemmer().stem(word)
+
+
+def preprocessing(text):
+    """Preprocess text for sentiment analysis"""
+    text = html_tag_pattern.sub('', text)
+    emojis = emoticon_pattern.findall(text)
+    text = non_word_pattern.sub(' ', text.lower()) + ' '.join(emojis).replace('-', '')
+    # Stopwords are dropped before the cache lookup so they never cost a stem
+    return " ".join([stem(word) for word in text.split() if word not in stopwords_set])
+
+
+def preprocess_batch(texts):
+    """Preprocess an iterable of texts and return a list of processed strings"""
+    # Bind hot globals locally; this loop runs once per uploaded row
+    strip_tags = html_tag_pattern.sub
+    find_emojis = emoticon_pattern.findall
+    split_words = non_word_pattern.sub
+    stops = stopwords_set
+    stem_word = stem
+
+    processed = []
+    append = processed.append
+    for text in texts:
+        text = strip_tags('', text)
+        emojis = find_emojis(text)
+        text = split_words(' ', text.lower()) + ' '.join(emojis).replace('-', '')
+        append(" ".join([stem_word(word) for word in text.split() if word not in stops]))
+    return processed